@@ -1,5 +1,6 @@
-from typing import Dict, List
+from typing import Dict, List, Tuple
 from dataclasses import dataclass
+from functools import lru_cache
 
 
 @dataclass
@@ -126,4 +127,29 @@ def parameters_to_dict(params: AnnotationParameters) -> Dict:
         "differentiation": params.differentiation,
         "language_focus": params.language_focus,
         "age_group": params.age_group
-    }
\ No newline at end of file
+    }
+
+
+# Named presets; unknown names fall back to kindergarten_phonics
+_PRESET_FACTORIES = {
+    "kindergarten_phonics": ParameterPresets.kindergarten_phonics,
+    "general_kindergarten": ParameterPresets.general_kindergarten,
+    "spanish_literacy": ParameterPresets.spanish_literacy,
+}
+
+
+@lru_cache(maxsize=None)
+def _preset_items(preset: str) -> Tuple:
+    """Build a preset once and keep it as immutable (key, value) pairs."""
+    parameters = parameters_to_dict(_PRESET_FACTORIES[preset]())
+    parameters["focus_areas"] = tuple(parameters["focus_areas"])
+    return tuple(parameters.items())
+
+
+def preset_to_dict(preset: str) -> Dict:
+    """Return a fresh parameters dictionary for a named preset."""
+    if preset not in _PRESET_FACTORIES:
+        preset = "kindergarten_phonics"
+    parameters = dict(_preset_items(preset))
+    parameters["focus_areas"] = list(parameters["focus_areas"])
+    return parameters
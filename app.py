@@ -4,12 +4,12 @@ import stripe
 from datetime import datetime, timedelta
 from flask import Flask, render_template, request, redirect, url_for, flash, send_file, jsonify, session
 from werkzeug.utils import secure_filename
-from werkzeug.security import generate_password_hash
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
 import json
+import orjson
 
 from lesson_annotator import LessonPlanAnnotator
-from annotation_parameters import ParameterPresets, AnnotationParameters, parameters_to_dict
+from annotation_parameters import ParameterPresets, AnnotationParameters, preset_to_dict
 from models import db, User, AnnotationProfile, UsageRecord, FeedbackReport, GiftCard
 from forms import RegistrationForm, LoginForm, ProfileForm, FeedbackForm, PasswordResetRequestForm, PasswordResetForm
 from stripe_integration import StripeService, get_stripe_public_key
@@ -34,6 +34,11 @@ def get_database_url():
 
 app.config['SQLALCHEMY_DATABASE_URI'] = get_database_url()
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# JSON columns (profile focus areas and category definitions) go through orjson
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+    'json_serializer': lambda obj: orjson.dumps(obj).decode('utf-8'),
+    'json_deserializer': orjson.loads
+}
 print(f"🗄️ Database URL: {app.config['SQLALCHEMY_DATABASE_URI'][:50]}...")
 
 # Configuration
@@ -81,7 +86,11 @@ def index():
     # Auto-load default profile if exists
     default_profile = next((p for p in user_profiles if p.is_default), None)
     if default_profile:
-        session['default_profile_data'] = default_profile.to_dict()
+        # Only write the session when the profile changed; any assignment makes
+        # Flask re-serialize, re-sign and resend the session cookie
+        profile_data = default_profile.to_dict()
+        if session.get('default_profile_data') != profile_data:
+            session['default_profile_data'] = profile_data
     
     return render_template('index.html', presets=presets, user_profiles=user_profiles)
 
@@ -142,13 +151,12 @@ def upload_file():
         if result["success"]:
             # Record usage for rate limiting (if user is logged in)
             if current_user.is_authenticated:
-                usage_record = UsageRecord(
-                    user_id=current_user.id,
-                    pdf_filename=filename,
-                    tokens_used=result.get("usage", {}).get("total_tokens"),
-                    success=True
-                )
-                db.session.add(usage_record)
+                UsageRecord.log({
+                    'user_id': current_user.id,
+                    'pdf_filename': filename,
+                    'tokens_used': result.get("usage", {}).get("total_tokens"),
+                    'success': True
+                })
                 db.session.commit()
             
             # Move annotated PDFs to downloads folder
@@ -247,16 +255,7 @@ def get_presets():
 def get_preset_details(preset_name):
     """API endpoint to get details for a specific preset."""
     try:
-        if preset_name == "kindergarten_phonics":
-            params = ParameterPresets.kindergarten_phonics()
-        elif preset_name == "general_kindergarten":
-            params = ParameterPresets.general_kindergarten()
-        elif preset_name == "spanish_literacy":
-            params = ParameterPresets.spanish_literacy()
-        else:
-            params = ParameterPresets.kindergarten_phonics()
-        
-        return jsonify(parameters_to_dict(params))
+        return jsonify(preset_to_dict(preset_name))
     except Exception as e:
         return jsonify({"error": str(e)}), 400
 
@@ -266,10 +265,7 @@ def _get_annotation_parameters(preset: str, form_data, custom_guidelines: str) -
     # Start with preset
     if preset == "custom":
         # Build custom parameters from form
-        focus_areas = []
-        for key in form_data:
-            if key.startswith('focus_area_') and form_data[key]:
-                focus_areas.append(form_data[key])
+        focus_areas = [area for area in form_data.getlist('focus_area') if area]
         
         if not focus_areas:
             focus_areas = ["Student Learning", "Engagement", "Assessment"]
@@ -286,28 +282,14 @@ def _get_annotation_parameters(preset: str, form_data, custom_guidelines: str) -
         }
     else:
         # Use preset and convert to dict
-        if preset == "kindergarten_phonics":
-            params = ParameterPresets.kindergarten_phonics()
-        elif preset == "general_kindergarten":
-            params = ParameterPresets.general_kindergarten()
-        elif preset == "spanish_literacy":
-            params = ParameterPresets.spanish_literacy()
-        else:
-            params = ParameterPresets.kindergarten_phonics()
-        
-        parameters = parameters_to_dict(params)
+        parameters = preset_to_dict(preset)
     
     # Add annotation theme (always available regardless of preset)
     parameters["annotation_theme"] = form_data.get('annotation_theme', 'educational')
     
     # Add custom category definitions if using custom theme
     if form_data.get('annotation_theme') == 'custom':
-        custom_categories = {}
-        for i in range(1, 9):  # category1 through category8
-            category_key = f'category{i}'
-            definition = form_data.get(f'category{i}_definition', '').strip()
-            if definition:
-                custom_categories[category_key] = definition
+        custom_categories = AnnotationProfile.category_definitions_from_form(form_data)
         if custom_categories:
             parameters["custom_category_definitions"] = custom_categories
     
@@ -368,6 +350,11 @@ def login():
         user = User.query.filter_by(username=form.username.data).first()
         
         if user and user.check_password(form.password.data):
+            # Upgrade hashes made with an older method while we have the password
+            if user.password_needs_rehash():
+                user.set_password(form.password.data)
+                db.session.commit()
+            
             login_user(user, remember=form.remember_me.data)
             flash(f'Welcome back, {user.username}!')
             
@@ -902,11 +889,12 @@ def admin_grant_access():
         return jsonify({'error': 'User not found'}), 404
     
     # Grant access
+    now = datetime.utcnow()
     user.subscription_status = 'active'
-    user.subscription_start = datetime.utcnow()
-    user.subscription_end = datetime.utcnow() + timedelta(days=days) if days > 0 else None
-    user.subscription_id = f"{access_type}_access_{datetime.now().strftime('%Y%m%d')}"
-    user.last_payment = datetime.utcnow()
+    user.subscription_start = now
+    user.subscription_end = now + timedelta(days=days) if days > 0 else None
+    user.subscription_id = f"{access_type}_access_{now.strftime('%Y%m%d')}"
+    user.last_payment = now
     
     db.session.commit()
     
@@ -931,23 +919,37 @@ def admin_list_users():
     if not verify_admin_api_access():
         return jsonify({'error': 'Unauthorized access'}), 401
     
-    users = User.query.all()
+    # Optional pagination: ?limit=N&offset=M (all users when no limit is given)
+    limit = request.args.get('limit', type=int)
+    offset = request.args.get('offset', 0, type=int)
+    
+    # Profile counts come from the same query to avoid one lazy load per user
+    query = db.session.query(User, db.func.count(AnnotationProfile.id)).outerjoin(
+        AnnotationProfile, AnnotationProfile.user_id == User.id
+    ).group_by(User.id).order_by(User.id)
+    if limit:
+        query = query.offset(offset).limit(limit)
+    users = query.all()
     user_list = []
     
-    for user in users:
+    for user, profile_count in users:
         user_list.append({
             'username': user.username,
             'email': user.email,
             'subscription_status': user.subscription_status,
             'access_type': user.get_access_type(),
             'expires': user.get_access_expires(),
-            'profile_count': len(user.annotation_profiles),
+            'profile_count': profile_count,
             'profile_limit': user.get_profile_limit(),
             'created_at': user.created_at.isoformat(),
             'is_alpha_tester': user.is_alpha_tester()
         })
     
-    return jsonify({'users': user_list})
+    response = {'users': user_list}
+    if limit:
+        # Offset of the next page, or None once the last page has been returned
+        response['next_offset'] = offset + len(user_list) if len(user_list) == limit else None
+    return jsonify(response)
 
 @app.route('/admin/revoke-access', methods=['POST'])
 def admin_revoke_access():
@@ -998,8 +1000,8 @@ def admin_list_feedback():
     priority_filter = request.args.get('priority', '')
     type_filter = request.args.get('type', '')
     
-    # Build query
-    query = FeedbackReport.query
+    # Build query (submitters are joined in so to_dict() doesn't load each one separately)
+    query = FeedbackReport.query.options(db.joinedload(FeedbackReport.user))
     
     if status_filter:
         query = query.filter(FeedbackReport.status == status_filter)
@@ -1110,9 +1112,9 @@ def admin_create_user():
         # Create new user
         new_user = User(
             username=username,
-            email=email,
-            password_hash=generate_password_hash(password)
+            email=email
         )
+        new_user.set_password(password)
         
         # Set optional fields
         if data.get('access_type'):
@@ -1181,7 +1183,7 @@ def admin_update_password():
             return jsonify({'error': 'User not found'}), 404
         
         # Update password
-        user.password_hash = generate_password_hash(new_password)
+        user.set_password(new_password)
         db.session.commit()
         
         # Log the admin action
@@ -1271,12 +1273,8 @@ def generate_gift_card():
         return jsonify({'error': 'Purchase ID is required'}), 400
     
     try:
-        # Generate unique gift card code
-        code = GiftCard.generate_code()
-        
         # Create gift card record
         gift_card = GiftCard(
-            code=code,
             value_months=data.get('value_months', 1),
             purchase_source='Teachers Pay Teachers',
             purchase_id=data.get('purchase_id'),
@@ -1289,7 +1287,8 @@ def generate_gift_card():
             from datetime import timedelta
             gift_card.expires_at = datetime.utcnow() + timedelta(days=int(data['expires_days']))
         
-        db.session.add(gift_card)
+        # Assign a unique code as part of the insert
+        code = gift_card.add_with_unique_code()
         db.session.commit()
         
         # Log the generation
@@ -1321,7 +1320,7 @@ def redeem_gift_card():
         return render_template('redeem_gift_card.html')
     
     # Process redemption
-    code = request.form.get('gift_card_code', '').strip().upper()
+    code = GiftCard.normalize_code(request.form.get('gift_card_code', ''))
     
     if not code:
         flash('Please enter a gift card code.', 'error')
@@ -1363,7 +1362,7 @@ def validate_gift_card():
     """API endpoint to validate a gift card without redeeming it."""
     
     data = request.get_json()
-    code = data.get('code', '').strip().upper()
+    code = GiftCard.normalize_code(data.get('code', ''))
     
     if not code:
         return jsonify({'valid': False, 'message': 'Gift card code is required'})
@@ -1391,7 +1390,9 @@ def admin_list_gift_cards():
         return jsonify({'error': 'Unauthorized access'}), 401
     
     try:
-        gift_cards = GiftCard.query.order_by(GiftCard.created_at.desc()).all()
+        gift_cards = GiftCard.query.options(db.joinedload(GiftCard.redeemed_by)).order_by(
+            GiftCard.created_at.desc()
+        ).all()
         
         gift_cards_data = []
         for gc in gift_cards:
@@ -1419,12 +1420,8 @@ def admin_generate_gift_card():
     data = request.get_json()
     
     try:
-        # Generate unique gift card code
-        code = GiftCard.generate_code()
-        
         # Create gift card record
         gift_card = GiftCard(
-            code=code,
             value_months=data.get('value_months', 1),
             purchase_source='Manual',
             purchase_email=data.get('purchase_email'),
@@ -1436,7 +1433,8 @@ def admin_generate_gift_card():
             from datetime import timedelta
             gift_card.expires_at = datetime.utcnow() + timedelta(days=int(data['expires_days']))
         
-        db.session.add(gift_card)
+        # Assign a unique code as part of the insert
+        code = gift_card.add_with_unique_code()
         db.session.commit()
         
         # Log the generation
@@ -1461,6 +1459,12 @@ def init_database():
     try:
         with app.app_context():
             db.create_all()
+            
+            # create_all() skips tables that already exist, so add any
+            # indexes declared since an existing database was created
+            for table in db.metadata.sorted_tables:
+                for index in table.indexes:
+                    index.create(bind=db.engine, checkfirst=True)
             print("✅ Database tables created successfully")
     except Exception as e:
         print(f"❌ Database initialization error: {e}")
@@ -16,7 +16,7 @@ from reportlab.lib.colors import blue, black, red, green, orange, purple, brown,
 from reportlab.lib.units import inch
 from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, PageBreak
 from reportlab.lib.enums import TA_LEFT, TA_CENTER
-from PyPDF2 import PdfWriter, PdfReader
+from pypdf import PdfWriter, PdfReader
 
 from smart_overlay_annotator import SmartOverlayAnnotator
 from inline_pdf_annotator import InlinePDFAnnotator
@@ -131,35 +131,46 @@ class CombinedPDFAnnotator:
         from reportlab.lib.colors import Color
         return Color(rgb_tuple[0], rgb_tuple[1], rgb_tuple[2])
     
-    def create_combined_pdf(self, annotations_data: Dict, output_filename: str = None) -> str:
-        """Create a single PDF combining all three annotation formats."""
+    def create_combined_pdf(self, annotations_data: Dict, output_filename: str = None,
+                            smart_overlay_pdf: str = None, inline_pdf: str = None) -> str:
+        """Create a single PDF combining all three annotation formats.
+        
+        Already generated smart overlay and inline PDFs can be passed in to be
+        reused as-is; they are only generated (as temp files) when missing.
+        """
         
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         if output_filename is None:
             output_filename = f"combined_annotations_{timestamp}.pdf"
         
+        # Only files generated here are temporary and cleaned up afterwards
+        temp_files = []
+        
         try:
-            # Create temporary files for each format
-            temp_smart_overlay = f"temp_smart_overlay_{timestamp}.pdf"
-            temp_inline = f"temp_inline_{timestamp}.pdf"
-            temp_traditional = f"temp_traditional_{timestamp}.pdf"
-            
-            print("🔄 Generating Smart Overlay PDF...")
-            smart_generator = SmartOverlayAnnotator(self.original_pdf_path, theme=self.theme)
-            smart_generator.create_smart_overlay_pdf(annotations_data, temp_smart_overlay)
+            if not (smart_overlay_pdf and os.path.exists(smart_overlay_pdf)):
+                print("🔄 Generating Smart Overlay PDF...")
+                smart_overlay_pdf = f"temp_smart_overlay_{timestamp}.pdf"
+                temp_files.append(smart_overlay_pdf)
+                smart_generator = SmartOverlayAnnotator(self.original_pdf_path, theme=self.theme)
+                smart_generator.create_smart_overlay_pdf(annotations_data, smart_overlay_pdf)
             
-            print("🔄 Generating Inline PDF...")
-            inline_generator = InlinePDFAnnotator(self.original_pdf_path)
-            inline_generator.create_inline_annotated_pdf(annotations_data, temp_inline)
+            if not (inline_pdf and os.path.exists(inline_pdf)):
+                print("🔄 Generating Inline PDF...")
+                inline_pdf = f"temp_inline_{timestamp}.pdf"
+                temp_files.append(inline_pdf)
+                inline_generator = InlinePDFAnnotator(self.original_pdf_path)
+                inline_generator.create_inline_annotated_pdf(annotations_data, inline_pdf)
             
+            temp_traditional = f"temp_traditional_{timestamp}.pdf"
+            temp_files.append(temp_traditional)
             print("🔄 Generating Color-Coded Traditional PDF...")
             self._create_color_coded_traditional_pdf(annotations_data, temp_traditional)
             
             print("🔄 Combining all PDFs...")
-            self._combine_all_pdfs([temp_smart_overlay, temp_inline, temp_traditional], output_filename)
+            self._combine_all_pdfs([smart_overlay_pdf, inline_pdf, temp_traditional], output_filename)
             
             # Clean up temporary files
-            for temp_file in [temp_smart_overlay, temp_inline, temp_traditional]:
+            for temp_file in temp_files:
                 if os.path.exists(temp_file):
                     os.remove(temp_file)
             
@@ -168,7 +179,7 @@ class CombinedPDFAnnotator:
         except Exception as e:
             print(f"Error creating combined PDF: {e}")
             # Clean up any remaining temp files
-            for temp_file in [temp_smart_overlay, temp_inline, temp_traditional]:
+            for temp_file in temp_files:
                 if os.path.exists(temp_file):
                     os.remove(temp_file)
             return None
@@ -298,6 +309,15 @@ class CombinedPDFAnnotator:
         doc.build(story)
         buffer.seek(0)
     
+    def _legend_item(self, color_rgb: Tuple[float, float, float], definition: str) -> str:
+        """Format one color legend entry, converting the RGB color to hex for HTML."""
+        hex_color = '#{:02x}{:02x}{:02x}'.format(
+            int(color_rgb[0] * 255),
+            int(color_rgb[1] * 255),
+            int(color_rgb[2] * 255)
+        )
+        return f'<font color="{hex_color}">■</font> <b>{definition}</b>'
+    
     def _create_color_legend(self, annotations_data: Dict) -> str:
         """Create HTML text for color legend using actual custom definitions."""
         legend_items = []
@@ -311,15 +331,10 @@ class CombinedPDFAnnotator:
             print(f"🎨 Using custom definitions: {custom_definitions}")
             
             # Create legend based on custom definitions and their corresponding colors
-            for category, definition in custom_definitions.items():
-                color_rgb = self.section_colors.get(category, (0.5, 0.5, 0.5))
-                # Convert RGB to hex for HTML
-                hex_color = '#{:02x}{:02x}{:02x}'.format(
-                    int(color_rgb[0] * 255),
-                    int(color_rgb[1] * 255),
-                    int(color_rgb[2] * 255)
-                )
-                legend_items.append(f'<font color="{hex_color}">■</font> <b>{definition}</b>')
+            legend_items = [
+                self._legend_item(self.section_colors.get(category, (0.5, 0.5, 0.5)), definition)
+                for category, definition in custom_definitions.items()
+            ]
         else:
             # Fallback to theme-based definitions
             try:
@@ -330,16 +345,11 @@ class CombinedPDFAnnotator:
                 theme_data = themes_data['themes'].get(self.theme, {})
                 category_definitions = theme_data.get('category_definitions', {})
                 
-                for category, color_rgb in self.section_colors.items():
-                    definition = category_definitions.get(category, category.replace('_', ' ').title())
-                    # Convert RGB to hex for HTML
-                    hex_color = '#{:02x}{:02x}{:02x}'.format(
-                        int(color_rgb[0] * 255),
-                        int(color_rgb[1] * 255),
-                        int(color_rgb[2] * 255)
-                    )
-                    legend_items.append(f'<font color="{hex_color}">■</font> <b>{definition}</b>')
-                    
+                legend_items = [
+                    self._legend_item(color_rgb, category_definitions.get(category, category.replace('_', ' ').title()))
+                    for category, color_rgb in self.section_colors.items()
+                ]
+                
             except Exception:
                 # Final fallback legend
                 legend_items = [
@@ -7,6 +7,7 @@ This allows users to test the application without needing actual API keys.
 from typing import Dict
 import json
 import time
+from functools import lru_cache
 
 
 class DemoAIClient:
@@ -85,8 +86,13 @@ class DemoAIClient:
         }
 
 
+@lru_cache(maxsize=1)
 def create_ai_client():
-    """Factory function to create appropriate AI client based on available API keys."""
+    """Factory function to create appropriate AI client based on available API keys.
+
+    The client is cached so every caller shares one OpenAI connection pool.
+    Failed constructions (e.g. missing API key) are not cached.
+    """
     import os
     from dotenv import load_dotenv
     
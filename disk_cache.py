@@ -0,0 +1,77 @@
+import os
+import json
+import time
+import tempfile
+from typing import Any, Optional
+
+# Root folder for every on-disk cache (AI responses, PDF text, layout analysis)
+CACHE_ROOT = os.environ.get("ANNOTATION_CACHE_DIR", "cache")
+# Entries not used for this long are evicted (default: one week)
+CACHE_MAX_AGE_SECONDS = int(os.environ.get("ANNOTATION_CACHE_MAX_AGE", 7 * 24 * 3600))
+# At most this many entries are kept per cache folder, least recently used go first
+CACHE_MAX_ENTRIES = int(os.environ.get("ANNOTATION_CACHE_MAX_ENTRIES", 256))
+
+
+def load_json(path: str) -> Optional[Any]:
+    """Return the value cached at path, or None when missing, unreadable or expired.
+
+    A hit refreshes the file's mtime, so eviction drops the least recently used entries.
+    """
+    try:
+        if time.time() - os.path.getmtime(path) > CACHE_MAX_AGE_SECONDS:
+            return None
+        with open(path, 'r', encoding='utf-8') as f:
+            value = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+    return value
+
+
+def store_json(path: str, value: Any, max_entries: int = CACHE_MAX_ENTRIES):
+    """Write value to path atomically, then evict old entries from its folder.
+
+    Raises OSError when the entry cannot be written; callers decide how to report it.
+    """
+    folder = os.path.dirname(path) or "."
+    os.makedirs(folder, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=folder, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(value, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    prune(folder, max_entries)
+
+
+def prune(folder: str, max_entries: int = CACHE_MAX_ENTRIES, max_age: float = CACHE_MAX_AGE_SECONDS):
+    """Delete expired .json entries in folder and all but the max_entries newest.
+
+    Only files directly inside folder are considered, so a cache stored in a
+    parent folder never evicts entries from the caches nested below it.
+    """
+    now = time.time()
+    entries = []
+    try:
+        with os.scandir(folder) as it:
+            for entry in it:
+                if entry.name.endswith('.json') and entry.is_file():
+                    entries.append((entry.stat().st_mtime, entry.path))
+    except OSError:
+        return
+
+    entries.sort(reverse=True)
+    for i, (mtime, path) in enumerate(entries):
+        if i >= max_entries or now - mtime > max_age:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
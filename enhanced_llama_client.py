@@ -1,21 +1,12 @@
-import os
-from openai import OpenAI
-from dotenv import load_dotenv
+from llama_client import LlamaAIClient
 from typing import List, Dict
 
-# Load environment variables
-load_dotenv()
 
-
-class EnhancedLlamaAIClient:
+class EnhancedLlamaAIClient(LlamaAIClient):
     """Enhanced client for generating section-specific inline annotations."""
     
     def __init__(self):
-        self.client = OpenAI(
-            api_key=os.environ.get("LLAMA_API_KEY"),
-            base_url="https://api.llama.com/compat/v1/",
-        )
-        self.model = "Llama-4-Maverick-17B-128E-Instruct-FP8"
+        super().__init__(verbose_errors=False)
     
     def generate_inline_annotations(self, lesson_content: str, parameters: Dict) -> Dict:
         """Generate section-specific annotations optimized for inline placement."""
@@ -32,23 +23,9 @@ class EnhancedLlamaAIClient:
                 temperature=0.7,
                 max_tokens=1500  # Reduced for more concise annotations
             )
-            
-            return {
-                "success": True,
-                "annotations": response.choices[0].message.content,
-                "usage": {
-                    "prompt_tokens": response.usage.prompt_tokens,
-                    "completion_tokens": response.usage.completion_tokens,
-                    "total_tokens": response.usage.total_tokens
-                }
-            }
-            
+            return self._success_result(response)
         except Exception as e:
-            return {
-                "success": False,
-                "error": str(e),
-                "annotations": None
-            }
+            return self._error_result(e)
     
     def _build_inline_annotation_prompt(self, lesson_content: str, parameters: Dict) -> str:
         """Build prompt optimized for inline annotations."""
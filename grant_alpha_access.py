@@ -5,8 +5,15 @@ Perfect for alpha testers, beta users, or promotional access.
 """
 
 from app import app
-from models import db, User
+from models import db, User, AnnotationProfile
 from datetime import datetime, timedelta
+from sqlalchemy import func, update
+
+def _find_user(email_or_username, *columns):
+    """Look up a user by email, then by username, as two unique-index point lookups."""
+    query = db.session.query(*columns)
+    return (query.filter(User.email == email_or_username).first() or
+            query.filter(User.username == email_or_username).first())
 
 def grant_alpha_access(email_or_username, duration_days=365, access_type='alpha'):
     """
@@ -19,11 +26,8 @@ def grant_alpha_access(email_or_username, duration_days=365, access_type='alpha'
     """
     
     with app.app_context():
-        # Find user by email or username
-        user = User.query.filter(
-            (User.email == email_or_username) | 
-            (User.username == email_or_username)
-        ).first()
+        # Find user by email or username (plain columns, no ORM instance)
+        user = _find_user(email_or_username, User.id, User.username, User.email, User.subscription_status)
         
         if not user:
             print(f"❌ User not found: {email_or_username}")
@@ -31,51 +35,111 @@ def grant_alpha_access(email_or_username, duration_days=365, access_type='alpha'
         
         print(f"📧 Found user: {user.username} ({user.email})")
         print(f"📊 Current status: {user.subscription_status}")
-        print(f"💎 Currently premium: {user.is_premium()}")
-        
-        # Set subscription details
-        user.subscription_status = 'active'
-        user.subscription_start = datetime.utcnow()
+        print(f"💎 Currently premium: {user.subscription_status == 'active'}")
         
+        # Set subscription details from a single UTC timestamp
+        now = datetime.utcnow()
         if duration_days > 0:
-            user.subscription_end = datetime.utcnow() + timedelta(days=duration_days)
+            subscription_end = now + timedelta(days=duration_days)
         else:
-            user.subscription_end = None  # Lifetime access
-        
-        user.last_payment = datetime.utcnow()
-        
-        # Add a note in subscription_id to track this is alpha access
-        user.subscription_id = f"{access_type}_access_{datetime.now().strftime('%Y%m%d')}"
-        
+            subscription_end = None  # Lifetime access
+        
+        db.session.execute(
+            update(User).where(User.id == user.id).values(
+                subscription_status='active',
+                subscription_start=now,
+                subscription_end=subscription_end,
+                last_payment=now,
+                # Add a note in subscription_id to track this is alpha access
+                subscription_id=f"{access_type}_access_{now.strftime('%Y%m%d')}"
+            )
+        )
         db.session.commit()
         
+        # Transient instance (never added to the session) to report the new limits
+        granted = User(subscription_status='active')
+        
         print(f"✅ SUCCESS! Granted {access_type} access to {user.username}")
-        print(f"📅 Access expires: {user.subscription_end.strftime('%Y-%m-%d') if user.subscription_end else 'Never (lifetime)'}")
-        print(f"🎯 Profile limit: {user.get_profile_limit()}")
-        print(f"⚡ Rate limit: {'Unlimited' if user.is_premium() else '5/hour'}")
+        print(f"📅 Access expires: {subscription_end.strftime('%Y-%m-%d') if subscription_end else 'Never (lifetime)'}")
+        print(f"🎯 Profile limit: {granted.get_profile_limit()}")
+        print(f"⚡ Rate limit: {'Unlimited' if granted.is_premium() else '5/hour'}")
         
         return True
 
+def grant_alpha_access_bulk(entries):
+    """
+    Grant alpha/premium access to a batch of users in a single transaction.
+    
+    Args:
+        entries: Iterable of dicts with 'key' (email or username) and optional
+                 'days' (default: 365) and 'access_type' (default: 'alpha')
+    
+    Returns the number of users updated.
+    """
+    
+    entries = list(entries)
+    keys = [entry['key'] for entry in entries]
+    
+    with app.app_context():
+        # Two set lookups instead of one query per user; emails win over usernames
+        by_key = {}
+        for column in (User.username, User.email):
+            for user_id, key in db.session.query(User.id, column).filter(column.in_(keys)):
+                by_key[key] = user_id
+        
+        now = datetime.utcnow()
+        mappings = []
+        for entry in entries:
+            user_id = by_key.get(entry['key'])
+            if user_id is None:
+                print(f"❌ User not found: {entry['key']}")
+                continue
+            
+            duration_days = entry.get('days', 365)
+            access_type = entry.get('access_type', 'alpha')
+            mappings.append({
+                'id': user_id,
+                'subscription_status': 'active',
+                'subscription_start': now,
+                'subscription_end': now + timedelta(days=duration_days) if duration_days > 0 else None,
+                'last_payment': now,
+                'subscription_id': f"{access_type}_access_{now.strftime('%Y%m%d')}"
+            })
+        
+        if mappings:
+            db.session.bulk_update_mappings(User, mappings)
+            db.session.commit()
+        
+        print(f"✅ SUCCESS! Granted access to {len(mappings)}/{len(entries)} users")
+        return len(mappings)
+
 def list_alpha_users():
     """List all users with alpha/beta access."""
     
     with app.app_context():
-        # Find users with alpha/beta access
-        alpha_users = User.query.filter(
-            User.subscription_id.like('%alpha_access%') |
-            User.subscription_id.like('%beta_access%') |
+        # Find users with alpha/beta access (subscription_id always starts with
+        # the access type). autoescape keeps '_' literal in the generated LIKE.
+        # This still scans the user table: the OR with subscription_status and
+        # case-insensitive LIKE (SQLite; Postgres without text_pattern_ops)
+        # rule out the plain subscription_id index.
+        # Profile counts come from the same query to avoid one lazy load per user
+        alpha_users = db.session.query(User, func.count(AnnotationProfile.id)).outerjoin(
+            AnnotationProfile, AnnotationProfile.user_id == User.id
+        ).filter(
+            User.subscription_id.startswith('alpha_access', autoescape=True) |
+            User.subscription_id.startswith('beta_access', autoescape=True) |
             (User.subscription_status == 'active')
-        ).all()
+        ).group_by(User.id).all()
         
         print("🧪 Alpha/Premium Users:")
         print("=" * 60)
         
-        for user in alpha_users:
+        for user, profile_count in alpha_users:
             access_type = "Unknown"
             if user.subscription_id:
-                if 'alpha_access' in user.subscription_id:
+                if user.subscription_id.startswith('alpha_access'):
                     access_type = "Alpha Tester"
-                elif 'beta_access' in user.subscription_id:
+                elif user.subscription_id.startswith('beta_access'):
                     access_type = "Beta Tester"
                 elif user.subscription_id.startswith('sub_'):
                     access_type = "Paid Subscriber"
@@ -88,17 +152,14 @@ def list_alpha_users():
             print(f"   Type: {access_type}")
             print(f"   Status: {user.subscription_status}")
             print(f"   Expires: {expires}")
-            print(f"   Profiles: {len(user.annotation_profiles)}/{user.get_profile_limit()}")
+            print(f"   Profiles: {profile_count}/{user.get_profile_limit()}")
             print("-" * 40)
 
 def revoke_access(email_or_username):
     """Revoke premium access from a user."""
     
     with app.app_context():
-        user = User.query.filter(
-            (User.email == email_or_username) | 
-            (User.username == email_or_username)
-        ).first()
+        user = _find_user(email_or_username, User.id, User.username, User.email)
         
         if not user:
             print(f"❌ User not found: {email_or_username}")
@@ -106,17 +167,23 @@ def revoke_access(email_or_username):
         
         print(f"📧 Found user: {user.username} ({user.email})")
         
-        user.subscription_status = 'free'
-        user.subscription_id = None
-        user.subscription_start = None
-        user.subscription_end = None
-        user.last_payment = None
-        
+        db.session.execute(
+            update(User).where(User.id == user.id).values(
+                subscription_status='free',
+                subscription_id=None,
+                subscription_start=None,
+                subscription_end=None,
+                last_payment=None
+            )
+        )
         db.session.commit()
         
+        # Transient instance (never added to the session) to report the new limits
+        revoked = User(subscription_status='free')
+        
         print(f"✅ Access revoked for {user.username}")
-        print(f"📊 New status: {user.subscription_status}")
-        print(f"🎯 Profile limit: {user.get_profile_limit()}")
+        print(f"📊 New status: {revoked.subscription_status}")
+        print(f"🎯 Profile limit: {revoked.get_profile_limit()}")
         
         return True
 
@@ -132,6 +199,7 @@ if __name__ == '__main__':
         print("  python3 grant_alpha_access.py list")
         print("  python3 grant_alpha_access.py revoke user@email.com")
         print("  python3 grant_alpha_access.py grant user@email.com 30 beta  # 30 days beta access")
+        print("  python3 grant_alpha_access.py grant-bulk users.txt 30 beta  # one email/username per line")
         sys.exit(1)
     
     command = sys.argv[1].lower()
@@ -142,6 +210,14 @@ if __name__ == '__main__':
         access_type = sys.argv[4] if len(sys.argv) > 4 else 'alpha'
         grant_alpha_access(email, days, access_type)
         
+    elif command == 'grant-bulk' and len(sys.argv) >= 3:
+        days = int(sys.argv[3]) if len(sys.argv) > 3 else 365
+        access_type = sys.argv[4] if len(sys.argv) > 4 else 'alpha'
+        with open(sys.argv[2]) as f:
+            entries = [{'key': line.strip(), 'days': days, 'access_type': access_type}
+                       for line in f if line.strip()]
+        grant_alpha_access_bulk(entries)
+        
     elif command == 'list':
         list_alpha_users()
         
@@ -150,4 +226,4 @@ if __name__ == '__main__':
         revoke_access(email)
         
     else:
-        print("❌ Invalid command. Use: grant, list, or revoke")
\ No newline at end of file
+        print("❌ Invalid command. Use: grant, grant-bulk, list, or revoke")
\ No newline at end of file
@@ -1,7 +1,7 @@
 import io
 import re
 from datetime import datetime
-from typing import Dict, List, Tuple
+from typing import Dict, Iterable, Iterator, List, Tuple, Union
 from reportlab.pdfgen import canvas
 from reportlab.lib.pagesizes import letter, A4
 from reportlab.lib.colors import blue, red, green, black, gray, orange, purple
@@ -9,21 +9,115 @@ from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
 from reportlab.lib.units import inch, mm
 from reportlab.lib.enums import TA_LEFT, TA_JUSTIFY, TA_CENTER
-import PyPDF2
+import pypdf
 import json
+from xml.sax.saxutils import escape
+
+
+# Section header keywords, checked in priority order (first match wins).
+# Patterns are lowercase and matched against a line lowered once per line.
+_SECTION_PATTERNS = {
+    "objectives": re.compile(r'objetivos|objectives'),
+    "materials": re.compile(r'materiales|materials'),
+    "activity": re.compile(r'nosotros leemos|lectura compartida|actividad'),
+    "assessment": re.compile(r'evaluación|assessment|compartir'),
+}
+
+# Parsed annotation key -> section header text in the AI response
+_ANNOTATION_SECTIONS = {
+    "pedagogical_strengths": "Pedagogical Strengths",
+    "engagement_opportunities": "Student Engagement",
+    "assessment_suggestions": "Assessment Suggestions",
+    "differentiation": "Differentiation Strategies",
+    "resource_optimization": "Resource Optimization",
+    "extension_activities": "Extension Activities",
+    "improvements": "Areas for Improvement",
+    "cultural_considerations": "Cultural/Linguistic",
+}
+
+# Annotation type and heading cycled through for successive activities
+_ACTIVITY_ANNOT_TYPES = ("differentiation", "extension_activities", "improvements")
+_ACTIVITY_ANNOT_TITLES = ("🎯 Differentiation Ideas", "➕ Extension Activities", "🔧 Improvement Suggestions")
+
+# Markdown emphasis/heading characters dropped from annotation lines
+_ANNOT_STRIP = str.maketrans('', '', '*#')
+
+
+def _join_lines(lines: List[str]) -> str:
+    """Join lines into newline-terminated text."""
+    return "".join(f"{line}\n" for line in lines)
+
+
+# Paragraph styles are immutable in use, so build them once at import time
+_STYLES = getSampleStyleSheet()
+
+_TITLE_STYLE = ParagraphStyle(
+    'CustomTitle',
+    parent=_STYLES['Heading1'],
+    fontSize=18,
+    spaceAfter=20,
+    textColor=blue,
+    alignment=TA_CENTER
+)
+
+_SECTION_TITLE_STYLE = ParagraphStyle(
+    'SectionTitle',
+    parent=_STYLES['Heading2'],
+    fontSize=14,
+    spaceBefore=15,
+    spaceAfter=10,
+    textColor=purple,
+    alignment=TA_LEFT
+)
+
+_CONTENT_STYLE = ParagraphStyle(
+    'Content',
+    parent=_STYLES['Normal'],
+    fontSize=11,
+    spaceAfter=8,
+    alignment=TA_JUSTIFY,
+    leftIndent=0.2*inch
+)
+
+_ANNOTATION_STYLE = ParagraphStyle(
+    'Annotation',
+    parent=_STYLES['Normal'],
+    fontSize=10,
+    spaceAfter=5,
+    alignment=TA_LEFT,
+    leftIndent=0.3*inch,
+    textColor=blue,
+    backColor=None
+)
+
+_ANNOTATION_TITLE_STYLE = ParagraphStyle(
+    'AnnotationTitle',
+    parent=_STYLES['Heading3'],
+    fontSize=11,
+    spaceBefore=8,
+    spaceAfter=5,
+    textColor=orange,
+    alignment=TA_LEFT,
+    leftIndent=0.2*inch
+)
 
 
 class InlinePDFAnnotator:
     """Enhanced PDF annotator that adds inline annotations alongside lesson plan content."""
     
-    def __init__(self, original_pdf_path: str):
+    def __init__(self, original_pdf_path: str, lesson_text: str = None):
         self.original_pdf_path = original_pdf_path
+        self.lesson_text = lesson_text  # Text already extracted from this PDF, if any
         self.annotations = {}
         self.lesson_sections = []
         self.output_path = ""
         
-    def create_inline_annotated_pdf(self, annotations_data: Dict, output_filename: str = None) -> str:
-        """Create PDF with inline annotations integrated into the lesson plan."""
+    def create_inline_annotated_pdf(self, annotations_data: Dict, output_filename: str = None, as_bytes: bool = False) -> Union[str, bytes]:
+        """Create PDF with inline annotations integrated into the lesson plan.
+        
+        Returns the output filename, or the raw PDF bytes without touching disk
+        when as_bytes is True.
+        """
         
         if output_filename is None:
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
@@ -41,43 +135,72 @@ class InlinePDFAnnotator:
         # Create sections with inline annotations
         annotated_sections = self._create_annotated_sections(lesson_content, parsed_annotations)
         
-        # Generate the annotated PDF
-        self._generate_inline_pdf(annotated_sections, output_filename)
+        # Generate the annotated PDF in memory and write it out in one call
+        pdf_bytes = self._generate_inline_pdf(annotated_sections, parsed_annotations)
+        if as_bytes:
+            return pdf_bytes
+        
+        with open(output_filename, 'wb') as f:
+            f.write(pdf_bytes)
         
         return output_filename
     
     def _extract_lesson_content(self) -> Dict:
-        """Extract and structure lesson plan content."""
+        """Extract and structure lesson plan content.
+        
+        Uses lesson_text when the caller already extracted this PDF's text, and
+        only falls back to pypdf otherwise.
+        """
+        if self.lesson_text:
+            sections = self._identify_lesson_sections(self.lesson_text.split('\n'))
+            sections["full_text"] = self.lesson_text
+            return sections
+        
         try:
             with open(self.original_pdf_path, 'rb') as file:
-                pdf_reader = PyPDF2.PdfReader(file)
-                full_text = ""
+                pdf_reader = pypdf.PdfReader(file)
+                page_texts = []
                 
-                for page in pdf_reader.pages:
-                    full_text += page.extract_text() + "\n"
+                # Structure the content into logical sections as pages stream in
+                sections = self._identify_lesson_sections(self._iter_page_lines(pdf_reader, page_texts))
+                sections["full_text"] = "".join(f"{text}\n" for text in page_texts)
                 
-                # Structure the content into logical sections
-                sections = self._identify_lesson_sections(full_text)
+                # Keep the text so later PDFs from this instance skip pypdf
+                self.lesson_text = sections["full_text"]
                 return sections
                 
         except Exception as e:
             print(f"Error extracting lesson content: {e}")
             return {"full_text": "", "sections": []}
     
-    def _identify_lesson_sections(self, text: str) -> Dict:
-        """Identify different sections of the lesson plan."""
-        sections = {
-            "header": "",
-            "objectives": "",
-            "materials": "",
-            "activities": [],
-            "assessment": "",
-            "full_text": text
+    def _iter_page_lines(self, pdf_reader, page_texts: List[str]) -> Iterator[str]:
+        """Yield text lines page by page, recording each page's raw text in page_texts.
+        
+        Every page is yielded: lines without a section keyword are continuation
+        text for the current section, so no page can be skipped.
+        
+        Extraction stays sequential: pypdf's extract_text is pure Python and holds
+        the GIL, and one reader's file stream cannot be shared across threads.
+        """
+        for page in pdf_reader.pages:
+            page_text = page.extract_text()
+            page_texts.append(page_text)
+            yield from page_text.split('\n')
+    
+    def _identify_lesson_sections(self, lines: Iterable[str]) -> Dict:
+        """Identify different sections of the lesson plan from an iterable of text lines."""
+        # Collect lines in lists and join once at the end
+        section_lines = {
+            "header": [],
+            "objectives": [],
+            "materials": [],
+            "assessment": []
         }
+        activities = []
+        header_length = 0
         
-        lines = text.split('\n')
         current_section = "header"
-        current_activity = ""
+        current_activity = []
         
         for line in lines:
             line = line.strip()
@@ -85,42 +208,45 @@ class InlinePDFAnnotator:
                 continue
                 
             # Identify section headers
-            if any(keyword in line.lower() for keyword in ['objetivos', 'objectives']):
-                current_section = "objectives"
-                continue
-            elif any(keyword in line.lower() for keyword in ['materiales', 'materials']):
-                current_section = "materials"
-                continue
-            elif any(keyword in line.lower() for keyword in ['nosotros leemos', 'lectura compartida', 'actividad']):
+            lower = line.lower()
+            header = next((name for name, pattern in _SECTION_PATTERNS.items() if pattern.search(lower)), None)
+            if header == "activity":
                 if current_activity:
-                    sections["activities"].append(current_activity)
-                current_activity = line + "\n"
+                    activities.append(current_activity)
+                current_activity = [line]
                 current_section = "activity"
                 continue
-            elif any(keyword in line.lower() for keyword in ['evaluación', 'assessment', 'compartir']):
+            elif header == "assessment":
                 if current_activity:
-                    sections["activities"].append(current_activity)
-                    current_activity = ""
+                    activities.append(current_activity)
+                    current_activity = []
                 current_section = "assessment"
                 continue
+            elif header:
+                current_section = header
+                continue
             
             # Add content to appropriate section
-            if current_section == "header" and len(sections["header"]) < 500:
-                sections["header"] += line + "\n"
-            elif current_section == "objectives":
-                sections["objectives"] += line + "\n"
-            elif current_section == "materials":
-                sections["materials"] += line + "\n"
+            if current_section == "header":
+                if header_length < 500:
+                    section_lines["header"].append(line)
+                    header_length += len(line) + 1
             elif current_section == "activity":
-                current_activity += line + "\n"
-            elif current_section == "assessment":
-                sections["assessment"] += line + "\n"
+                current_activity.append(line)
+            else:
+                section_lines[current_section].append(line)
         
         # Add final activity if exists
         if current_activity:
-            sections["activities"].append(current_activity)
-        
-        return sections
+            activities.append(current_activity)
+        
+        return {
+            "header": _join_lines(section_lines["header"]),
+            "objectives": _join_lines(section_lines["objectives"]),
+            "materials": _join_lines(section_lines["materials"]),
+            "activities": [_join_lines(activity) for activity in activities],
+            "assessment": _join_lines(section_lines["assessment"])
+        }
     
     def _parse_ai_annotations(self) -> Dict:
         """Parse AI annotations into section-specific insights."""
@@ -129,41 +255,48 @@ class InlinePDFAnnotator:
         
         annotation_text = self.annotations['annotations']
         
-        # Extract different types of annotations
-        parsed = {
-            "pedagogical_strengths": self._extract_annotation_section(annotation_text, "Pedagogical Strengths"),
-            "engagement_opportunities": self._extract_annotation_section(annotation_text, "Student Engagement"),
-            "assessment_suggestions": self._extract_annotation_section(annotation_text, "Assessment Suggestions"),
-            "differentiation": self._extract_annotation_section(annotation_text, "Differentiation Strategies"),
-            "resource_optimization": self._extract_annotation_section(annotation_text, "Resource Optimization"),
-            "extension_activities": self._extract_annotation_section(annotation_text, "Extension Activities"),
-            "improvements": self._extract_annotation_section(annotation_text, "Areas for Improvement"),
-            "cultural_considerations": self._extract_annotation_section(annotation_text, "Cultural/Linguistic")
-        }
-        
-        return parsed
+        # Extract all annotation types in a single pass over the text
+        return self._extract_annotation_sections(annotation_text, _ANNOTATION_SECTIONS)
     
-    def _extract_annotation_section(self, text: str, section_name: str) -> List[str]:
-        """Extract specific annotation section as bullet points."""
-        lines = text.split('\n')
-        in_section = False
-        section_content = []
-        
-        for line in lines:
+    def _extract_annotation_sections(self, text: str, section_names: Dict[str, str]) -> Dict[str, List[str]]:
+        """Extract several annotation sections as bullet points in one pass over the text.
+        
+        Each section starts at the first marked line ('**' or '##') containing its
+        name and ends at the next marked line that does not.
+        """
+        names_lower = {key: name.lower() for key, name in section_names.items()}
+        section_content = {key: [] for key in section_names}
+        active = set()
+        finished = set()
+        
+        for line in text.split('\n'):
             line = line.strip()
+            line_lower = line.lower()
+            is_marked = '**' in line or '##' in line
             
-            if section_name.lower() in line.lower() and ('**' in line or '##' in line):
-                in_section = True
-                continue
-            elif in_section and ('**' in line or '##' in line) and section_name.lower() not in line.lower():
+            for key, name_lower in names_lower.items():
+                if key in finished:
+                    continue
+                if is_marked and name_lower in line_lower:
+                    active.add(key)
+                elif key in active and is_marked:
+                    active.discard(key)
+                    finished.add(key)
+                elif key in active and line:
+                    # Clean up bullet points and formatting
+                    clean_line = line.translate(_ANNOT_STRIP).strip()
+                    if clean_line and not clean_line.startswith('###'):
+                        section_content[key].append(clean_line)
+                        # Only the top 3 points per section are kept, so stop collecting
+                        if len(section_content[key]) >= 3:
+                            active.discard(key)
+                            finished.add(key)
+            
+            # Stop scanning once every section is complete
+            if len(finished) == len(names_lower):
                 break
-            elif in_section and line:
-                # Clean up bullet points and formatting
-                clean_line = line.replace('*', '').replace('#', '').strip()
-                if clean_line and not clean_line.startswith('###'):
-                    section_content.append(clean_line)
         
-        return section_content[:3]  # Limit to top 3 points per section
+        return section_content
     
     def _create_annotated_sections(self, lesson_content: Dict, annotations: Dict) -> List[Dict]:
         """Create lesson sections with inline annotations."""
@@ -206,18 +339,18 @@ class InlinePDFAnnotator:
             })
         
         # Activities with differentiation and extensions
+        activity_insights = [annotations.get(annotation_type, []) for annotation_type in _ACTIVITY_ANNOT_TYPES]
         for i, activity in enumerate(lesson_content.get("activities", [])):
-            annotation_type = ["differentiation", "extension_activities", "improvements"][i % 3]
-            annotation_titles = ["🎯 Differentiation Ideas", "➕ Extension Activities", "🔧 Improvement Suggestions"]
+            cycle = i % len(_ACTIVITY_ANNOT_TYPES)
             
             annotated_sections.append({
                 "type": "activity",
                 "title": f"🎓 Actividad {i+1}",
                 "content": activity,
                 "annotations": {
-                    "type": annotation_type,
-                    "title": annotation_titles[i % 3],
-                    "insights": annotations.get(annotation_type, [])[:2]
+                    "type": _ACTIVITY_ANNOT_TYPES[cycle],
+                    "title": _ACTIVITY_ANNOT_TITLES[cycle],
+                    "insights": activity_insights[cycle][:2]
                 }
             })
         
@@ -236,10 +369,11 @@ class InlinePDFAnnotator:
         
         return annotated_sections
     
-    def _generate_inline_pdf(self, sections: List[Dict], output_filename: str):
-        """Generate PDF with inline annotations."""
+    def _generate_inline_pdf(self, sections: List[Dict], parsed_annotations: Dict) -> bytes:
+        """Generate PDF with inline annotations and return its bytes."""
+        buffer = io.BytesIO()
         doc = SimpleDocTemplate(
-            output_filename,
+            buffer,
             pagesize=letter,
             rightMargin=0.5*inch,
             leftMargin=0.5*inch,
@@ -247,109 +381,55 @@ class InlinePDFAnnotator:
             bottomMargin=0.75*inch
         )
         
-        # Define styles
-        styles = getSampleStyleSheet()
-        
-        title_style = ParagraphStyle(
-            'CustomTitle',
-            parent=styles['Heading1'],
-            fontSize=18,
-            spaceAfter=20,
-            textColor=blue,
-            alignment=TA_CENTER
-        )
-        
-        section_title_style = ParagraphStyle(
-            'SectionTitle',
-            parent=styles['Heading2'],
-            fontSize=14,
-            spaceBefore=15,
-            spaceAfter=10,
-            textColor=purple,
-            alignment=TA_LEFT
-        )
-        
-        content_style = ParagraphStyle(
-            'Content',
-            parent=styles['Normal'],
-            fontSize=11,
-            spaceAfter=8,
-            alignment=TA_JUSTIFY,
-            leftIndent=0.2*inch
-        )
-        
-        annotation_style = ParagraphStyle(
-            'Annotation',
-            parent=styles['Normal'],
-            fontSize=10,
-            spaceAfter=5,
-            alignment=TA_LEFT,
-            leftIndent=0.3*inch,
-            textColor=blue,
-            backColor=None
-        )
-        
-        annotation_title_style = ParagraphStyle(
-            'AnnotationTitle',
-            parent=styles['Heading3'],
-            fontSize=11,
-            spaceBefore=8,
-            spaceAfter=5,
-            textColor=orange,
-            alignment=TA_LEFT,
-            leftIndent=0.2*inch
-        )
-        
-        # Build story
-        story = []
-        
-        # Add main title
-        story.append(Paragraph("🎓 AI-Enhanced Lesson Plan", title_style))
-        story.append(Spacer(1, 0.3*inch))
+        # Build story, adding each section's flowables in one extend
+        story = [Paragraph("🎓 AI-Enhanced Lesson Plan", _TITLE_STYLE), Spacer(1, 0.3*inch)]
         
         # Process each section
         for section in sections:
+            insights = section["annotations"]["insights"]
             if section["type"] == "title":
                 # Lesson title and overview
-                story.append(Paragraph(section["content"][:200] + "...", content_style))
-                
-                if section["annotations"]["insights"]:
-                    story.append(Paragraph("🌟 Key Strengths Identified", annotation_title_style))
-                    for insight in section["annotations"]["insights"]:
-                        story.append(Paragraph(f"• {insight}", annotation_style))
+                story.append(Paragraph(section["content"][:200] + "...", _CONTENT_STYLE))
+                if insights:
+                    story.extend((Paragraph("🌟 Key Strengths Identified", _ANNOTATION_TITLE_STYLE),
+                                  self._insight_bullets(insights)))
                 story.append(Spacer(1, 0.2*inch))
                 
             else:
-                # Section content
-                story.append(Paragraph(section["title"], section_title_style))
-                
-                # Create two-column layout: content + annotations
+                # Section title and main content
                 content_text = section["content"][:400] + ("..." if len(section["content"]) > 400 else "")
-                
-                # Main content
-                story.append(Paragraph(content_text, content_style))
+                story.extend((Paragraph(section["title"], _SECTION_TITLE_STYLE),
+                              Paragraph(content_text, _CONTENT_STYLE)))
                 
                 # Inline annotations
-                if section["annotations"]["insights"]:
-                    story.append(Paragraph(section["annotations"]["title"], annotation_title_style))
-                    for insight in section["annotations"]["insights"]:
-                        story.append(Paragraph(f"• {insight[:150]}{'...' if len(insight) > 150 else ''}", annotation_style))
+                if insights:
+                    story.extend((Paragraph(section["annotations"]["title"], _ANNOTATION_TITLE_STYLE),
+                                  self._insight_bullets(insights, max_length=150)))
                 
                 story.append(Spacer(1, 0.15*inch))
         
         # Add summary section
-        story.append(Spacer(1, 0.3*inch))
-        story.append(Paragraph("📋 Summary of AI Recommendations", section_title_style))
+        story.extend((Spacer(1, 0.3*inch),
+                      Paragraph("📋 Summary of AI Recommendations", _SECTION_TITLE_STYLE)))
         
         # Get cultural considerations if available
-        cultural_insights = self._parse_ai_annotations().get("cultural_considerations", [])
+        cultural_insights = parsed_annotations.get("cultural_considerations", [])
         if cultural_insights:
-            story.append(Paragraph("🌍 Cultural & Linguistic Considerations", annotation_title_style))
-            for insight in cultural_insights[:2]:
-                story.append(Paragraph(f"• {insight}", annotation_style))
+            story.extend((Paragraph("🌍 Cultural & Linguistic Considerations", _ANNOTATION_TITLE_STYLE),
+                          self._insight_bullets(cultural_insights[:2])))
         
         # Build PDF
         doc.build(story)
+        return buffer.getvalue()
+    
+    def _insight_bullets(self, insights: List[str], max_length: int = None) -> Paragraph:
+        """Render insights as one bulleted Paragraph instead of one flowable per insight."""
+        bullets = []
+        for insight in insights:
+            if max_length is not None and len(insight) > max_length:
+                insight = insight[:max_length] + "..."
+            bullets.append(f"• {escape(insight)}")
+        return Paragraph("<br/>".join(bullets), _ANNOTATION_STYLE)
 
 
 def create_inline_annotated_pdf_from_json(json_file: str, original_pdf: str = None) -> str:
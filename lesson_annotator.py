@@ -1,30 +1,33 @@
 import os
-import json
+import orjson
+from pathlib import Path
 from datetime import datetime
 from typing import Dict, Optional
-from pdf_extractor import PDFExtractor
-from demo_ai_client import create_ai_client
-from enhanced_llama_client import EnhancedLlamaAIClient
-from annotation_parameters import ParameterPresets, parameters_to_dict
-from pdf_annotator import PDFAnnotationGenerator
-from inline_pdf_annotator import InlinePDFAnnotator
-from pdf_overlay_annotator import PDFOverlayAnnotator
-from smart_overlay_annotator import SmartOverlayAnnotator
-from combined_pdf_annotator import CombinedPDFAnnotator
+from annotation_parameters import ParameterPresets, preset_to_dict
+
+# PDF and AI client modules (openai, PyMuPDF, reportlab, pypdf) are imported
+# where they are used, so importing this module (e.g. via app.py in the CLI
+# admin scripts) stays cheap.
 
 
 class LessonPlanAnnotator:
     """Main class for AI-powered lesson plan annotation."""
     
-    def __init__(self, pdf_path: str):
+    def __init__(self, pdf_path: str, cache_text: bool = False):
+        from pdf_extractor import PDFExtractor
+        from demo_ai_client import create_ai_client
+        from enhanced_llama_client import EnhancedLlamaAIClient
+        
         self.pdf_path = pdf_path
-        self.pdf_extractor = PDFExtractor(pdf_path)
+        self._pdf_stem = Path(pdf_path).stem  # Base name for output files
+        self.pdf_extractor = PDFExtractor(pdf_path, use_cache=cache_text)
         self.ai_client = create_ai_client()
         try:
             self.enhanced_ai_client = EnhancedLlamaAIClient()
         except Exception:
             self.enhanced_ai_client = None
         self.lesson_content = ""
+        self.prompt_content = ""  # Compacted lesson text sent to the AI
         self.lesson_structure = {}
         self.annotations = {}
         
@@ -54,13 +57,18 @@ class LessonPlanAnnotator:
         
         if annotation_result["success"]:
             print("📝 Annotations generated successfully!")
+            
+            # One timestamp for the whole run so all output files share it
+            now = datetime.now()
+            timestamp = now.strftime("%Y%m%d_%H%M%S")
+            
             result = {
                 "success": True,
                 "lesson_info": {
                     "pdf_path": self.pdf_path,
                     "structure": self.lesson_structure,
                     "parameters_used": parameters,
-                    "timestamp": datetime.now().isoformat()
+                    "timestamp": now.isoformat()
                 },
                 "annotations": annotation_result["annotations"],
                 "usage": annotation_result.get("usage", {}),
@@ -68,23 +76,24 @@ class LessonPlanAnnotator:
             }
             
             # Save results
-            self._save_results(result)
+            self._save_results(result, timestamp)
             
-            # Generate combined PDF with all annotation formats
+            # Keep individual PDF generation for backward compatibility (optional)
+            # Users can still access individual formats if needed
+            annotated_pdf = self._create_annotated_pdf(result, timestamp)
+            inline_pdf = self._create_inline_annotated_pdf(result, timestamp)
+            overlay_pdf = self._create_overlay_annotated_pdf(result, timestamp)
+            smart_overlay_pdf = self._create_smart_overlay_annotated_pdf(result, timestamp)
+            
+            # Generate combined PDF with all annotation formats, reusing the
+            # smart overlay and inline PDFs generated above
             print("📄 Creating comprehensive combined PDF...")
-            combined_pdf = self._create_combined_annotated_pdf(result)
+            combined_pdf = self._create_combined_annotated_pdf(result, smart_overlay_pdf, inline_pdf, timestamp)
             
             if combined_pdf:
                 result["combined_annotated_pdf"] = combined_pdf
                 print(f"📑 🎯 Comprehensive annotated PDF saved as: {combined_pdf}")
             
-            # Keep individual PDF generation for backward compatibility (optional)
-            # Users can still access individual formats if needed
-            annotated_pdf = self._create_annotated_pdf(result)
-            inline_pdf = self._create_inline_annotated_pdf(result)
-            overlay_pdf = self._create_overlay_annotated_pdf(result)
-            smart_overlay_pdf = self._create_smart_overlay_annotated_pdf(result)
-            
             if annotated_pdf:
                 result["annotated_pdf"] = annotated_pdf
             if inline_pdf:
@@ -106,7 +115,10 @@ class LessonPlanAnnotator:
         try:
             pages = self.pdf_extractor.extract_text()
             if pages:
+                from pdf_extractor import compact_lesson_text
+                
                 self.lesson_content = "\n\n".join(pages)
+                self.prompt_content = compact_lesson_text(pages)
                 return True
             return False
         except Exception as e:
@@ -119,39 +131,42 @@ class LessonPlanAnnotator:
     
     def _get_parameters(self, preset: str) -> Dict:
         """Get annotation parameters based on preset."""
-        if preset == "kindergarten_phonics":
-            params = ParameterPresets.kindergarten_phonics()
-        elif preset == "general_kindergarten":
-            params = ParameterPresets.general_kindergarten()
-        elif preset == "spanish_literacy":
-            params = ParameterPresets.spanish_literacy()
-        else:
-            params = ParameterPresets.kindergarten_phonics()  # default
-        
-        return parameters_to_dict(params)
+        return preset_to_dict(preset)
     
     def _generate_annotations(self, parameters: Dict) -> Dict:
         """Generate AI annotations using the Llama API."""
-        return self.ai_client.generate_annotations(self.lesson_content, parameters)
+        return self.ai_client.generate_annotations(self.prompt_content or self.lesson_content, parameters)
     
-    def _save_results(self, results: Dict):
+    def _save_results(self, results: Dict, timestamp: Optional[str] = None):
         """Save annotation results to JSON file."""
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        timestamp = timestamp or datetime.now().strftime("%Y%m%d_%H%M%S")
         filename = f"annotations_{timestamp}.json"
+        temp_filename = f"{filename}.tmp"
         
         try:
-            with open(filename, 'w', encoding='utf-8') as f:
-                json.dump(results, f, indent=2, ensure_ascii=False)
+            # orjson emits the same UTF-8, 2-space-indented JSON as json.dump, much faster
+            data = orjson.dumps(results, option=orjson.OPT_INDENT_2, default=str)
+            
+            # Write to a temp file and rename so a crash never leaves a truncated file
+            with open(temp_filename, 'wb') as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_filename, filename)
             print(f"💾 Results saved to {filename}")
         except Exception as e:
             print(f"Warning: Could not save results to file: {e}")
+            if os.path.exists(temp_filename):
+                os.remove(temp_filename)
     
-    def _create_annotated_pdf(self, results: Dict) -> Optional[str]:
+    def _create_annotated_pdf(self, results: Dict, timestamp: Optional[str] = None) -> Optional[str]:
         """Create annotated PDF with AI insights."""
+        from pdf_annotator import PDFAnnotationGenerator
+        
         try:
             generator = PDFAnnotationGenerator(self.pdf_path)
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            output_filename = f"annotated_{os.path.basename(self.pdf_path).replace('.pdf', '')}_{timestamp}.pdf"
+            timestamp = timestamp or datetime.now().strftime("%Y%m%d_%H%M%S")
+            output_filename = f"annotated_{self._pdf_stem}_{timestamp}.pdf"
             
             annotated_pdf = generator.create_annotated_pdf(results, output_filename)
             return annotated_pdf
@@ -160,12 +175,15 @@ class LessonPlanAnnotator:
             print(f"Warning: Could not create annotated PDF: {e}")
             return None
     
-    def _create_inline_annotated_pdf(self, results: Dict) -> Optional[str]:
+    def _create_inline_annotated_pdf(self, results: Dict, timestamp: Optional[str] = None) -> Optional[str]:
         """Create inline annotated PDF with AI insights."""
+        from inline_pdf_annotator import InlinePDFAnnotator
+        
         try:
-            generator = InlinePDFAnnotator(self.pdf_path)
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            output_filename = f"inline_{os.path.basename(self.pdf_path).replace('.pdf', '')}_{timestamp}.pdf"
+            # Hand over the text extracted for the AI prompt so pypdf is skipped
+            generator = InlinePDFAnnotator(self.pdf_path, lesson_text=self.lesson_content)
+            timestamp = timestamp or datetime.now().strftime("%Y%m%d_%H%M%S")
+            output_filename = f"inline_{self._pdf_stem}_{timestamp}.pdf"
             
             inline_pdf = generator.create_inline_annotated_pdf(results, output_filename)
             return inline_pdf
@@ -174,12 +192,14 @@ class LessonPlanAnnotator:
             print(f"Warning: Could not create inline annotated PDF: {e}")
             return None
     
-    def _create_overlay_annotated_pdf(self, results: Dict) -> Optional[str]:
+    def _create_overlay_annotated_pdf(self, results: Dict, timestamp: Optional[str] = None) -> Optional[str]:
         """Create overlay annotated PDF with AI insights as visual overlays."""
+        from pdf_overlay_annotator import PDFOverlayAnnotator
+        
         try:
             generator = PDFOverlayAnnotator(self.pdf_path)
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            output_filename = f"overlay_{os.path.basename(self.pdf_path).replace('.pdf', '')}_{timestamp}.pdf"
+            timestamp = timestamp or datetime.now().strftime("%Y%m%d_%H%M%S")
+            output_filename = f"overlay_{self._pdf_stem}_{timestamp}.pdf"
             
             overlay_pdf = generator.create_overlay_annotated_pdf(results, output_filename)
             return overlay_pdf
@@ -188,14 +208,16 @@ class LessonPlanAnnotator:
             print(f"Warning: Could not create overlay annotated PDF: {e}")
             return None
     
-    def _create_smart_overlay_annotated_pdf(self, results: Dict) -> Optional[str]:
+    def _create_smart_overlay_annotated_pdf(self, results: Dict, timestamp: Optional[str] = None) -> Optional[str]:
         """Create smart overlay annotated PDF with intelligent positioning."""
+        from smart_overlay_annotator import SmartOverlayAnnotator
+        
         try:
             # Get theme from current parameters, default to 'educational'
             theme = getattr(self, 'current_parameters', {}).get('annotation_theme', 'educational')
             generator = SmartOverlayAnnotator(self.pdf_path, theme=theme)
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            output_filename = f"smart_overlay_{os.path.basename(self.pdf_path).replace('.pdf', '')}_{timestamp}.pdf"
+            timestamp = timestamp or datetime.now().strftime("%Y%m%d_%H%M%S")
+            output_filename = f"smart_overlay_{self._pdf_stem}_{timestamp}.pdf"
             
             smart_overlay_pdf = generator.create_smart_overlay_pdf(results, output_filename)
             return smart_overlay_pdf
@@ -204,16 +226,20 @@ class LessonPlanAnnotator:
             print(f"Warning: Could not create smart overlay annotated PDF: {e}")
             return None
     
-    def _create_combined_annotated_pdf(self, results: Dict) -> Optional[str]:
+    def _create_combined_annotated_pdf(self, results: Dict, smart_overlay_pdf: Optional[str] = None,
+                                       inline_pdf: Optional[str] = None,
+                                       timestamp: Optional[str] = None) -> Optional[str]:
         """Create comprehensive combined PDF with all annotation formats."""
+        from combined_pdf_annotator import CombinedPDFAnnotator
+        
         try:
             # Get theme from current parameters, default to 'educational'
             theme = getattr(self, 'current_parameters', {}).get('annotation_theme', 'educational')
             generator = CombinedPDFAnnotator(self.pdf_path, theme=theme)
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            output_filename = f"combined_{os.path.basename(self.pdf_path).replace('.pdf', '')}_{timestamp}.pdf"
+            timestamp = timestamp or datetime.now().strftime("%Y%m%d_%H%M%S")
+            output_filename = f"combined_{self._pdf_stem}_{timestamp}.pdf"
             
-            combined_pdf = generator.create_combined_pdf(results, output_filename)
+            combined_pdf = generator.create_combined_pdf(results, output_filename, smart_overlay_pdf, inline_pdf)
             return combined_pdf
             
         except Exception as e:
@@ -241,8 +267,8 @@ def main():
         print(f"❌ PDF file not found: {pdf_path}")
         return
     
-    # Initialize annotator
-    annotator = LessonPlanAnnotator(pdf_path)
+    # Initialize annotator; a local PDF is re-run often, so cache its text
+    annotator = LessonPlanAnnotator(pdf_path, cache_text=True)
     
     # Show available presets
     presets = ParameterPresets.get_available_presets()
@@ -272,7 +298,7 @@ def main():
         # Show abbreviated version since full annotations are in the PDF
         annotations = result["annotations"]
         if len(annotations) > 500:
-            print(annotations[:500] + "...")
+            print(f"{annotations[:500]}...")
             print(f"\n[Full annotations available in the generated PDF: {result.get('annotated_pdf', 'N/A')}]")
         else:
             print(annotations)
@@ -1,16 +1,109 @@
 import os
+import hashlib
+import threading
+from string import Template
 from openai import OpenAI
 from dotenv import load_dotenv
-from typing import List, Dict
+from typing import Dict, Optional
+from disk_cache import CACHE_ROOT, load_json, store_json
 
 # Load environment variables
 load_dotenv()
 
+LLAMA_BASE_URL = "https://api.llama.com/compat/v1/"
+
+# One OpenAI client (and HTTP connection pool) per API key, shared by every AI client
+_shared_clients: Dict[Optional[str], OpenAI] = {}
+_shared_clients_lock = threading.Lock()
+
+
+def get_shared_client(api_key: Optional[str]) -> OpenAI:
+    """Return the process-wide OpenAI client for the Llama API and this key."""
+    with _shared_clients_lock:
+        client = _shared_clients.get(api_key)
+        if client is None:
+            client = _shared_clients[api_key] = OpenAI(api_key=api_key, base_url=LLAMA_BASE_URL)
+        return client
+
+
+# Annotation prompt, filled in per request by LlamaAIClient._build_annotation_prompt
+ANNOTATION_PROMPT_TEMPLATE = Template("""
+Please analyze and annotate this lesson plan with the following parameters:
+
+ANNOTATION PARAMETERS:
+- Focus Areas: $focus_areas
+- Pedagogical Approach: $pedagogical_approach
+- Student Engagement Level: $engagement_level
+- Assessment Type: $assessment_type
+- Differentiation Needs: $differentiation
+- Language Focus: $language_focus
+- Age Group: $age_group
+
+$custom_guidelines
+
+LESSON PLAN CONTENT:
+$lesson_content
+
+Please provide annotations in the following categories:
+
+$categories
+
+Provide specific, actionable recommendations that a kindergarten teacher could immediately implement.
+""")
+
+DEFAULT_ANNOTATION_CATEGORIES = """1. **Pedagogical Strengths**: What teaching strategies are particularly effective?
+
+2. **Student Engagement Opportunities**: How can student participation be enhanced?
+
+3. **Assessment Suggestions**: Recommended formative and summative assessment strategies.
+
+4. **Differentiation Strategies**: How to accommodate different learning levels and styles.
+
+5. **Resource Optimization**: Suggestions for better use of materials and time.
+
+6. **Extension Activities**: Additional activities to deepen learning.
+
+7. **Areas for Improvement**: Constructive suggestions for enhancement.
+
+8. **Cultural/Linguistic Considerations**: Spanish language learning specific insights."""
+
+_AUTH_ERROR_EXPLANATION = (
+    "❌ Invalid API Key!\n\n"
+    "Your AI API key is not valid. Please:\n"
+    "1. Check your API key at: https://platform.openai.com/api-keys\n"
+    "2. Make sure you have credit/quota available\n"
+    "3. Update the .env file with a valid key\n"
+    "4. Restart the application"
+)
+
+# (lowercase substring, explanation) pairs checked in order by LlamaAIClient._explain_error
+_ERROR_EXPLANATIONS = (
+    ("401", _AUTH_ERROR_EXPLANATION),
+    ("authentication", _AUTH_ERROR_EXPLANATION),
+    ("429", (
+        "⏱️ Rate Limit Exceeded!\n\n"
+        "You've hit the API rate limit. Please:\n"
+        "1. Wait a few minutes before trying again\n"
+        "2. Check your API quota at: https://platform.openai.com/usage\n"
+        "3. Consider upgrading your API plan if needed"
+    )),
+    ("quota", (
+        "💳 Quota Exceeded!\n\n"
+        "Your API quota has been exceeded. Please:\n"
+        "1. Add credits to your account at: https://platform.openai.com/settings/organization/billing\n"
+        "2. Check your usage at: https://platform.openai.com/usage\n"
+        "3. Wait until your quota resets (if on free tier)"
+    )),
+)
+
+# Successful annotation responses are cached on disk by prompt hash
+CACHE_FOLDER = CACHE_ROOT
+
 
 class LlamaAIClient:
     """Client for interacting with Llama AI API."""
     
-    def __init__(self):
+    def __init__(self, verbose_errors: bool = True):
         api_key = os.environ.get("LLAMA_API_KEY") or os.environ.get("OPENAI_API_KEY")
         
         if not api_key or api_key.startswith("demo_key"):
@@ -25,106 +118,116 @@ class LlamaAIClient:
                 "but PDF annotation requires a valid AI service key."
             )
         
-        self.client = OpenAI(
-            api_key=api_key,
-            base_url="https://api.llama.com/compat/v1/",
-        )
+        self.api_key = api_key
+        self.base_url = LLAMA_BASE_URL
+        self.client = get_shared_client(api_key)
         self.model = "Llama-4-Maverick-17B-128E-Instruct-FP8"
+        self.verbose_errors = verbose_errors  # Explain common API errors to the user
     
     def generate_annotations(self, lesson_content: str, annotation_parameters: Dict) -> Dict:
         """Generate intelligent annotations for lesson plan content."""
         
         prompt = self._build_annotation_prompt(lesson_content, annotation_parameters)
+        cached = self._load_cached(prompt)
+        if cached:
+            return cached
         
         try:
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": "You are an expert educational consultant specializing in Spanish language learning and kindergarten pedagogy. Provide detailed, actionable annotations for lesson plans."},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0.7,
-                max_tokens=2000
-            )
-            
-            return {
-                "success": True,
-                "annotations": response.choices[0].message.content,
-                "usage": {
-                    "prompt_tokens": response.usage.prompt_tokens,
-                    "completion_tokens": response.usage.completion_tokens,
-                    "total_tokens": response.usage.total_tokens
-                }
-            }
-            
+            response = self.client.chat.completions.create(**self._completion_kwargs(prompt))
+            return self._store_cached(prompt, self._success_result(response))
         except Exception as e:
-            error_message = str(e)
-            
-            # Provide more helpful error messages for common issues
-            if "401" in error_message or "Authentication" in error_message:
-                error_message = (
-                    "❌ Invalid API Key!\n\n"
-                    "Your AI API key is not valid. Please:\n"
-                    "1. Check your API key at: https://platform.openai.com/api-keys\n"
-                    "2. Make sure you have credit/quota available\n"
-                    "3. Update the .env file with a valid key\n"
-                    "4. Restart the application\n\n"
-                    f"Original error: {error_message}"
-                )
-            elif "429" in error_message:
-                error_message = (
-                    "⏱️ Rate Limit Exceeded!\n\n"
-                    "You've hit the API rate limit. Please:\n"
-                    "1. Wait a few minutes before trying again\n"
-                    "2. Check your API quota at: https://platform.openai.com/usage\n"
-                    "3. Consider upgrading your API plan if needed\n\n"
-                    f"Original error: {error_message}"
-                )
-            elif "quota" in error_message.lower():
-                error_message = (
-                    "💳 Quota Exceeded!\n\n"
-                    "Your API quota has been exceeded. Please:\n"
-                    "1. Add credits to your account at: https://platform.openai.com/settings/organization/billing\n"
-                    "2. Check your usage at: https://platform.openai.com/usage\n"
-                    "3. Wait until your quota resets (if on free tier)\n\n"
-                    f"Original error: {error_message}"
-                )
-            
-            return {
-                "success": False,
-                "error": error_message,
-                "annotations": None
+            return self._error_result(e)
+    
+    def _completion_kwargs(self, prompt: str) -> Dict:
+        """Build the chat completion request for an annotation prompt."""
+        return {
+            "model": self.model,
+            "messages": [
+                {"role": "system", "content": "You are an expert educational consultant specializing in Spanish language learning and kindergarten pedagogy. Provide detailed, actionable annotations for lesson plans."},
+                {"role": "user", "content": prompt}
+            ],
+            "temperature": 0.7,
+            "max_tokens": 2000
+        }
+    
+    def _success_result(self, response) -> Dict:
+        """Convert a chat completion response into an annotation result."""
+        return {
+            "success": True,
+            "annotations": response.choices[0].message.content,
+            "usage": {
+                "prompt_tokens": response.usage.prompt_tokens,
+                "completion_tokens": response.usage.completion_tokens,
+                "total_tokens": response.usage.total_tokens
             }
+        }
+    
+    def _cache_path(self, prompt: str) -> str:
+        """Cache file for a prompt; the prompt already embeds lesson content and parameters."""
+        key = hashlib.sha256(f"{self.model}\n{prompt}".encode('utf-8')).hexdigest()
+        return os.path.join(CACHE_FOLDER, f"{key}.json")
+    
+    def _load_cached(self, prompt: str) -> Optional[Dict]:
+        """Return a previously cached annotation result for this prompt, if any.
+        
+        No tokens are spent on a hit, so usage is zeroed and the result is
+        flagged as cached rather than repeating the original call's usage.
+        """
+        cached = load_json(self._cache_path(prompt))
+        if not cached:
+            return None
+        cached["usage"] = {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+        cached["cached"] = True
+        return cached
+    
+    def _store_cached(self, prompt: str, result: Dict) -> Dict:
+        """Write a successful result to the cache atomically and return it unchanged."""
+        try:
+            store_json(self._cache_path(prompt), result)
+        except OSError as e:
+            print(f"Warning: Could not cache annotations: {e}")
+        return result
+    
+    def _error_result(self, e: Exception) -> Dict:
+        """Convert an API exception into an annotation result with a helpful message."""
+        error_message = str(e)
+        
+        # Provide more helpful error messages for common issues
+        if self.verbose_errors:
+            error_message = self._explain_error(error_message)
+        
+        return {
+            "success": False,
+            "error": error_message,
+            "annotations": None
+        }
+    
+    def _explain_error(self, error_message: str) -> str:
+        """Expand common API errors (bad key, rate limit, quota) into user guidance."""
+        lowered = error_message.lower()
+        for needle, explanation in _ERROR_EXPLANATIONS:
+            if needle in lowered:
+                return f"{explanation}\n\nOriginal error: {error_message}"
+        
+        return error_message
     
     def _build_annotation_prompt(self, lesson_content: str, parameters: Dict) -> str:
         """Build the prompt for annotation generation."""
         
         custom_guidelines = parameters.get('custom_guidelines', '')
         
-        prompt = f"""
-Please analyze and annotate this lesson plan with the following parameters:
-
-ANNOTATION PARAMETERS:
-- Focus Areas: {', '.join(parameters.get('focus_areas', []))}
-- Pedagogical Approach: {parameters.get('pedagogical_approach', 'Balanced')}
-- Student Engagement Level: {parameters.get('engagement_level', 'High')}
-- Assessment Type: {parameters.get('assessment_type', 'Formative')}
-- Differentiation Needs: {parameters.get('differentiation', 'Multi-level')}
-- Language Focus: {parameters.get('language_focus', 'Spanish')}
-- Age Group: {parameters.get('age_group', '5-6 years')}
-
-{f"CUSTOM GUIDELINES: {custom_guidelines}" if custom_guidelines else ""}
-
-LESSON PLAN CONTENT:
-{lesson_content}
-
-Please provide annotations in the following categories:
-
-{self._get_annotation_categories(parameters)}
-
-Provide specific, actionable recommendations that a kindergarten teacher could immediately implement.
-"""
-        return prompt
+        return ANNOTATION_PROMPT_TEMPLATE.substitute(
+            focus_areas=', '.join(parameters.get('focus_areas', [])),
+            pedagogical_approach=parameters.get('pedagogical_approach', 'Balanced'),
+            engagement_level=parameters.get('engagement_level', 'High'),
+            assessment_type=parameters.get('assessment_type', 'Formative'),
+            differentiation=parameters.get('differentiation', 'Multi-level'),
+            language_focus=parameters.get('language_focus', 'Spanish'),
+            age_group=parameters.get('age_group', '5-6 years'),
+            custom_guidelines=f"CUSTOM GUIDELINES: {custom_guidelines}" if custom_guidelines else "",
+            lesson_content=lesson_content,
+            categories=self._get_annotation_categories(parameters)
+        )
     
     def _get_annotation_categories(self, parameters: Dict) -> str:
         """Generate annotation categories based on theme and custom definitions."""
@@ -132,24 +235,10 @@ Provide specific, actionable recommendations that a kindergarten teacher could i
         
         if custom_categories:
             # Use custom user-defined categories
-            categories = []
-            for i, (category_key, definition) in enumerate(custom_categories.items(), 1):
-                categories.append(f"{i}. **{definition}**: Provide specific insights and recommendations related to: {definition}")
-            return "\n\n".join(categories)
+            return "\n\n".join(
+                f"{i}. **{definition}**: Provide specific insights and recommendations related to: {definition}"
+                for i, definition in enumerate(custom_categories.values(), 1)
+            )
         else:
             # Use default predefined categories
-            return """1. **Pedagogical Strengths**: What teaching strategies are particularly effective?
-
-2. **Student Engagement Opportunities**: How can student participation be enhanced?
-
-3. **Assessment Suggestions**: Recommended formative and summative assessment strategies.
-
-4. **Differentiation Strategies**: How to accommodate different learning levels and styles.
-
-5. **Resource Optimization**: Suggestions for better use of materials and time.
-
-6. **Extension Activities**: Additional activities to deepen learning.
-
-7. **Areas for Improvement**: Constructive suggestions for enhancement.
-
-8. **Cultural/Linguistic Considerations**: Spanish language learning specific insights."""
\ No newline at end of file
+            return DEFAULT_ANNOTATION_CATEGORIES
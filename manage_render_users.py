@@ -5,15 +5,26 @@ This allows you to grant alpha access to users in your production database.
 """
 
 import requests
+from requests.adapters import HTTPAdapter
 import json
 import os
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 
+# Concurrent requests for bulk grants; also the size of the HTTP connection pool
+MAX_PARALLEL_REQUESTS = 32
+
 class RenderUserManager:
     def __init__(self, base_url):
         """Initialize with your Render app URL."""
         self.base_url = base_url.rstrip('/')
         
+        # One session so repeated admin calls reuse TCP/TLS connections
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=MAX_PARALLEL_REQUESTS, pool_maxsize=MAX_PARALLEL_REQUESTS)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        
     def create_admin_api_endpoint(self):
         """
         You'll need to add an admin API endpoint to your Flask app.
@@ -70,27 +81,40 @@ def admin_list_users():
     if admin_key != os.getenv('ADMIN_API_KEY', 'your-secret-admin-key'):
         return jsonify({'error': 'Unauthorized'}), 401
     
-    users = User.query.all()
+    # Optional pagination: ?limit=N&offset=M (all users when no limit is given)
+    limit = request.args.get('limit', type=int)
+    offset = request.args.get('offset', 0, type=int)
+    
+    # Profile counts come from the same query to avoid one lazy load per user
+    query = db.session.query(User, db.func.count(AnnotationProfile.id)).outerjoin(
+        AnnotationProfile, AnnotationProfile.user_id == User.id
+    ).group_by(User.id).order_by(User.id)
+    if limit:
+        query = query.offset(offset).limit(limit)
+    users = query.all()
     user_list = []
     
-    for user in users:
+    for user, profile_count in users:
         user_list.append({
             'username': user.username,
             'email': user.email,
             'subscription_status': user.subscription_status,
             'access_type': user.get_access_type(),
             'expires': user.get_access_expires(),
-            'profile_count': len(user.annotation_profiles),
+            'profile_count': profile_count,
             'profile_limit': user.get_profile_limit(),
             'created_at': user.created_at.isoformat()
         })
     
-    return jsonify({'users': user_list})
+    response = {'users': user_list}
+    if limit:
+        response['next_offset'] = offset + len(user_list) if len(user_list) == limit else None
+    return jsonify(response)
 '''
         return admin_api_code
     
-    def grant_access_remote(self, email, days=365, access_type='alpha', admin_key='your-secret-admin-key'):
-        """Grant access to a user on the remote Render app."""
+    def _post_grant(self, email, days, access_type, admin_key):
+        """POST one grant request; returns (success, result dict or error message)."""
         
         url = f"{self.base_url}/admin/grant-access"
         headers = {
@@ -104,59 +128,102 @@ def admin_list_users():
         }
         
         try:
-            response = requests.post(url, json=data, headers=headers, timeout=30)
+            response = self.session.post(url, json=data, headers=headers, timeout=30)
             
             if response.status_code == 200:
-                result = response.json()
-                print(f"✅ SUCCESS! Granted {access_type} access to {result['user']}")
-                print(f"📧 Email: {result['email']}")
-                print(f"🎯 Profile limit: {result['profile_limit']}")
-                expires = result['expires']
-                print(f"📅 Expires: {expires if expires else 'Never'}")
-                return True
-            else:
-                error = response.json().get('error', 'Unknown error')
-                print(f"❌ ERROR: {error}")
-                return False
+                return True, response.json()
+            return False, response.json().get('error', 'Unknown error')
                 
         except requests.exceptions.RequestException as e:
-            print(f"❌ Network error: {e}")
+            return False, f"Network error: {e}"
+    
+    def grant_access_remote(self, email, days=365, access_type='alpha', admin_key='your-secret-admin-key'):
+        """Grant access to a user on the remote Render app."""
+        
+        success, result = self._post_grant(email, days, access_type, admin_key)
+        
+        if success:
+            print(f"✅ SUCCESS! Granted {access_type} access to {result['user']}")
+            print(f"📧 Email: {result['email']}")
+            print(f"🎯 Profile limit: {result['profile_limit']}")
+            expires = result['expires']
+            print(f"📅 Expires: {expires if expires else 'Never'}")
+            return True
+        else:
+            print(f"❌ ERROR: {result}")
             return False
     
-    def list_users_remote(self, admin_key='your-secret-admin-key'):
-        """List all users on the remote Render app."""
+    def grant_access_bulk(self, emails, days=365, access_type='alpha', admin_key='your-secret-admin-key'):
+        """Grant access to many users on the remote Render app with concurrent requests.
+        
+        Returns the number of successful grants.
+        """
+        
+        emails = list(emails)
+        if not emails:
+            return 0
+        
+        with ThreadPoolExecutor(max_workers=min(MAX_PARALLEL_REQUESTS, len(emails))) as executor:
+            results = list(executor.map(
+                lambda email: self._post_grant(email, days, access_type, admin_key), emails
+            ))
+        
+        granted = 0
+        for email, (success, result) in zip(emails, results):
+            if success:
+                granted += 1
+                expires = result['expires']
+                print(f"✅ {email}: {access_type} access, expires {expires if expires else 'Never'}")
+            else:
+                print(f"❌ {email}: {result}")
+        
+        print(f"🎯 Granted {access_type} access to {granted}/{len(emails)} users")
+        return granted
+    
+    def list_users_remote(self, admin_key='your-secret-admin-key', page_size=200):
+        """List all users on the remote Render app, fetching and printing a page at a time."""
         
         url = f"{self.base_url}/admin/list-users"
         headers = {'Admin-Key': admin_key}
+        users = []
+        offset = 0
         
         try:
-            response = requests.get(url, headers=headers, timeout=30)
-            
-            if response.status_code == 200:
-                result = response.json()
-                users = result['users']
+            while offset is not None:
+                response = self.session.get(url, headers=headers, timeout=30,
+                                            params={'limit': page_size, 'offset': offset})
+                
+                if response.status_code != 200:
+                    error = response.json().get('error', 'Unknown error')
+                    print(f"❌ ERROR: {error}")
+                    return users
                 
-                print("👥 Users on Render Deployment:")
-                print("=" * 60)
+                result = response.json()
+                page = result['users']
                 
-                for user in users:
-                    print(f"👤 {user['username']} ({user['email']})")
-                    print(f"   Access: {user['access_type']}")
-                    print(f"   Status: {user['subscription_status']}")
-                    print(f"   Expires: {user['expires']}")
-                    print(f"   Profiles: {user['profile_count']}/{user['profile_limit']}")
-                    print(f"   Joined: {user['created_at'][:10]}")
-                    print("-" * 40)
+                # Build each page's listing and write it once
+                lines = ["👥 Users on Render Deployment:", "=" * 60] if not users else []
+                for user in page:
+                    lines.extend((
+                        f"👤 {user['username']} ({user['email']})",
+                        f"   Access: {user['access_type']}",
+                        f"   Status: {user['subscription_status']}",
+                        f"   Expires: {user['expires']}",
+                        f"   Profiles: {user['profile_count']}/{user['profile_limit']}",
+                        f"   Joined: {user['created_at'][:10]}",
+                        "-" * 40
+                    ))
+                print("\n".join(lines))
                 
-                return users
-            else:
-                error = response.json().get('error', 'Unknown error')
-                print(f"❌ ERROR: {error}")
-                return []
+                users.extend(page)
+                # Servers without pagination return everything and no next_offset
+                offset = result.get('next_offset')
+            
+            return users
                 
         except requests.exceptions.RequestException as e:
             print(f"❌ Network error: {e}")
-            return []
+            return users
 
 def main():
     """Main function for command line usage."""
@@ -174,6 +241,7 @@ def main():
         print("  python3 manage_render_users.py list https://your-app.onrender.com")
         print("  python3 manage_render_users.py grant https://your-app.onrender.com user@email.com")
         print("  python3 manage_render_users.py grant https://your-app.onrender.com user@email.com 30 beta")
+        print("  python3 manage_render_users.py grant-bulk https://your-app.onrender.com emails.txt 30 beta")
         return
     
     command = sys.argv[1].lower()
@@ -194,8 +262,15 @@ def main():
         access_type = sys.argv[5] if len(sys.argv) > 5 else 'alpha'
         manager.grant_access_remote(email, days, access_type)
         
+    elif command == 'grant-bulk' and len(sys.argv) >= 4:
+        with open(sys.argv[3]) as f:
+            emails = [line.strip() for line in f if line.strip()]
+        days = int(sys.argv[4]) if len(sys.argv) > 4 else 365
+        access_type = sys.argv[5] if len(sys.argv) > 5 else 'alpha'
+        manager.grant_access_bulk(emails, days, access_type)
+        
     else:
-        print("❌ Invalid command. Use: list or grant")
+        print("❌ Invalid command. Use: list, grant, or grant-bulk")
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -5,17 +5,86 @@ Database models for user authentication and annotation profiles.
 
 import json
 import secrets
+import sqlite3
 from datetime import datetime, timedelta
+from functools import lru_cache
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
+from sqlalchemy import event, insert, update
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import validates
 from werkzeug.security import generate_password_hash, check_password_hash
 
 db = SQLAlchemy()
 
+# Password hashing scheme with its cost pinned, so a Werkzeug upgrade can't
+# silently change login latency (~0.1s per check on one core). Hashes made
+# with any other method are upgraded on the next successful login.
+PASSWORD_HASH_METHOD = 'scrypt:32768:8:1'
+
+# Timestamp columns use Python-side datetime.utcnow defaults, not server
+# defaults: existing tables were created without column defaults (there are
+# no migrations), and code such as the rate-limit window compares them to
+# utcnow(), so they must be naive UTC whatever the database's time zone.
+
+
+@event.listens_for(Engine, "connect")
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    """Use WAL journaling for local SQLite databases so readers don't block on writers."""
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.execute("PRAGMA mmap_size=268435456")
+    cursor.execute("PRAGMA cache_size=-65536")
+    cursor.close()
+
+
+# User id -> UTC time when a rate-limited free user may run annotations again.
+# Per process; premium users never reach it, so upgrades take effect at once.
+_rate_limited_until = {}
+_RATE_LIMIT_CACHE_SIZE = 10000
+
+
+# Granted access is recorded as subscription_id '<access_type>_access_<YYYYMMDD>'
+# (Stripe subscriptions use 'sub_...'), so the tier is always a prefix
+_TESTER_ACCESS_PREFIXES = ('alpha_access', 'beta_access')
+
+
+@lru_cache(maxsize=1024)
+def _access_type(subscription_status, subscription_id):
+    """Display access type for a subscription, memoized on the field values
+    so repeated template calls skip the subscription_id scans and updates
+    are never served stale."""
+    if subscription_status != 'active':
+        return "Free"
+    elif subscription_id:
+        if subscription_id.startswith('alpha_access'):
+            return "Alpha Tester"
+        elif subscription_id.startswith('beta_access'):
+            return "Beta Tester"
+        elif subscription_id.startswith('sub_'):
+            return "Premium Subscriber"
+        else:
+            return "Premium Access"
+    return "Premium"
+
 
 class User(UserMixin, db.Model):
     """User model for authentication."""
     
+    # Most users are free, so active-subscription scans use a small partial
+    # index; subscription_end serves expiry sweeps
+    __table_args__ = (
+        db.Index('ix_user_active_sub', 'subscription_status',
+                 postgresql_where=db.text("subscription_status = 'active'"),
+                 sqlite_where=db.text("subscription_status = 'active'")),
+        db.Index('ix_user_subscription_end', 'subscription_end'),
+    )
+    
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(80), unique=True, nullable=False)
     email = db.Column(db.String(120), unique=True, nullable=False)
@@ -26,7 +95,7 @@ class User(UserMixin, db.Model):
     # Subscription and billing fields
     stripe_customer_id = db.Column(db.String(100), unique=True)
     subscription_status = db.Column(db.String(20), default='free')  # free, active, past_due, canceled
-    subscription_id = db.Column(db.String(100))
+    subscription_id = db.Column(db.String(100), index=True)
     subscription_start = db.Column(db.DateTime)
     subscription_end = db.Column(db.DateTime)
     last_payment = db.Column(db.DateTime)
@@ -37,17 +106,21 @@ class User(UserMixin, db.Model):
     
     # Relationships
     annotation_profiles = db.relationship('AnnotationProfile', backref='user', lazy=True, cascade='all, delete-orphan')
-    usage_records = db.relationship('UsageRecord', backref='user', lazy=True, cascade='all, delete-orphan')
-    feedback_reports = db.relationship('FeedbackReport', backref='user', lazy=True, cascade='all, delete-orphan')
+    usage_records = db.relationship('UsageRecord', backref='user', lazy='raise_on_sql', cascade='all, delete-orphan')
+    feedback_reports = db.relationship('FeedbackReport', backref='user', lazy='raise_on_sql', cascade='all, delete-orphan')
     
     def set_password(self, password):
         """Hash and set password."""
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = generate_password_hash(password, method=PASSWORD_HASH_METHOD)
     
     def check_password(self, password):
         """Check if provided password matches hash."""
         return check_password_hash(self.password_hash, password)
     
+    def password_needs_rehash(self):
+        """Check if the stored hash was made with a method other than PASSWORD_HASH_METHOD."""
+        return not self.password_hash.startswith(f"{PASSWORD_HASH_METHOD}$")
+    
     def is_premium(self):
         """Check if user has active premium subscription."""
         return self.subscription_status == 'active'
@@ -60,44 +133,65 @@ class User(UserMixin, db.Model):
         """Get the maximum number of annotations per hour for this user."""
         return 999999 if self.is_premium() else 5  # Effectively unlimited for premium
     
-    def get_usage_count_last_hour(self):
-        """Get the number of annotations run in the last hour."""
+    def get_usage_count_last_hour(self, cap=None):
+        """Get the number of annotations run in the last hour.
+        
+        If cap is given, counting stops after cap records, which is all a
+        rate-limit check needs regardless of how much history the user has.
+        """
         one_hour_ago = datetime.utcnow() - timedelta(hours=1)
-        return UsageRecord.query.filter(
+        query = UsageRecord.query.with_entities(UsageRecord.id).filter(
             UsageRecord.user_id == self.id,
             UsageRecord.created_at >= one_hour_ago
-        ).count()
+        )
+        if cap is not None:
+            query = query.limit(cap)
+        return query.count()
     
     def can_run_annotation(self):
         """Check if user can run another annotation based on rate limits."""
         if self.is_premium():
             return True
-        return self.get_usage_count_last_hour() < self.get_hourly_usage_limit()
+        
+        # Users already known to be over the limit skip the database entirely
+        now = datetime.utcnow()
+        blocked_until = _rate_limited_until.get(self.id)
+        if blocked_until is not None:
+            if now < blocked_until:
+                return False
+            _rate_limited_until.pop(self.id, None)
+        
+        limit = self.get_hourly_usage_limit()
+        if self.get_usage_count_last_hour(cap=limit) < limit:
+            return True
+        
+        # Blocked uploads add no usage, so the user is under the limit again as
+        # soon as the limit-th most recent record leaves the one-hour window
+        oldest_counted = UsageRecord.query.with_entities(UsageRecord.created_at).filter(
+            UsageRecord.user_id == self.id
+        ).order_by(UsageRecord.created_at.desc()).offset(limit - 1).limit(1).scalar()
+        if oldest_counted is not None:
+            if len(_rate_limited_until) >= _RATE_LIMIT_CACHE_SIZE:
+                _rate_limited_until.clear()
+            _rate_limited_until[self.id] = oldest_counted + timedelta(hours=1)
+        return False
+    
+    def get_profile_count(self):
+        """Get the number of saved profiles (see User.profile_count below)."""
+        return self.profile_count or 0
     
     def can_create_profile(self):
         """Check if user can create another profile."""
-        current_count = len(self.annotation_profiles)
+        current_count = self.get_profile_count()
         return current_count < self.get_profile_limit()
     
     def is_alpha_tester(self):
         """Check if user is an alpha tester."""
-        return (self.subscription_id and 
-                ('alpha_access' in self.subscription_id or 'beta_access' in self.subscription_id))
+        return bool(self.subscription_id) and self.subscription_id.startswith(_TESTER_ACCESS_PREFIXES)
     
     def get_access_type(self):
         """Get the user's access type for display."""
-        if not self.is_premium():
-            return "Free"
-        elif self.subscription_id:
-            if 'alpha_access' in self.subscription_id:
-                return "Alpha Tester"
-            elif 'beta_access' in self.subscription_id:
-                return "Beta Tester"
-            elif self.subscription_id.startswith('sub_'):
-                return "Premium Subscriber"
-            else:
-                return "Premium Access"
-        return "Premium"
+        return _access_type(self.subscription_status, self.subscription_id)
     
     def get_access_expires(self):
         """Get when access expires, formatted for display."""
@@ -134,7 +228,7 @@ class AnnotationProfile(db.Model):
     """Model for storing user's custom annotation settings."""
     
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
     name = db.Column(db.String(100), nullable=False)
     description = db.Column(db.Text)
     
@@ -174,22 +268,22 @@ class AnnotationProfile(db.Model):
             'is_default': self.is_default
         }
     
+    @staticmethod
+    def category_definitions_from_form(form_data):
+        """Collect the non-empty category1..category8 definitions from form data."""
+        definitions = ((f'category{i}', form_data.get(f'category{i}_definition', '').strip()) for i in range(1, 9))
+        return {key: definition for key, definition in definitions if definition}
+    
     @classmethod
     def from_form_data(cls, user_id, name, description, form_data):
         """Create profile from form data."""
-        # Extract focus areas
-        focus_areas = []
-        for key in form_data:
-            if key.startswith('focus_area_') and form_data[key]:
-                focus_areas.append(form_data[key])
+        # Extract focus areas (checkboxes share the repeated 'focus_area' name)
+        focus_areas = [area for area in form_data.getlist('focus_area') if area]
         
         # Extract custom category definitions if using custom theme
         custom_categories = {}
         if form_data.get('annotation_theme') == 'custom':
-            for i in range(1, 9):
-                definition = form_data.get(f'category{i}_definition', '').strip()
-                if definition:
-                    custom_categories[f'category{i}'] = definition
+            custom_categories = cls.category_definitions_from_form(form_data)
         
         return cls(
             user_id=user_id,
@@ -211,9 +305,25 @@ class AnnotationProfile(db.Model):
         return f'<AnnotationProfile {self.name} by {self.user.username}>'
 
 
+# Read-only profile count on User, loaded by a COUNT subquery the first time it
+# is read and then kept on the instance until the session commits, so repeated
+# checks within a request (e.g. the donate page) cost one query. No column is
+# stored, so there is nothing to keep in sync or migrate.
+User.profile_count = db.column_property(
+    db.select(db.func.count(AnnotationProfile.id))
+    .where(AnnotationProfile.user_id == User.id)
+    .correlate_except(AnnotationProfile)
+    .scalar_subquery(),
+    deferred=True
+)
+
+
 class UsageRecord(db.Model):
     """Model for tracking user annotation usage for rate limiting."""
     
+    # Serves the per-user, last-hour range scans done for rate limiting
+    __table_args__ = (db.Index('ix_usage_user_created', 'user_id', 'created_at'),)
+    
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
@@ -224,6 +334,16 @@ class UsageRecord(db.Model):
     processing_time = db.Column(db.Float)  # seconds
     success = db.Column(db.Boolean, default=True)
     
+    @classmethod
+    def log(cls, *records):
+        """Insert usage records (dicts of column values) in one bulk INSERT.
+        
+        Skips the ORM unit of work since nothing reads the new rows back in
+        the same request; the caller commits.
+        """
+        if records:
+            db.session.execute(insert(cls), list(records))
+    
     def __repr__(self):
         return f'<UsageRecord user={self.user.username} at {self.created_at}>'
 
@@ -231,6 +351,12 @@ class UsageRecord(db.Model):
 class FeedbackReport(db.Model):
     """Model for storing user feedback, bug reports, and feature requests."""
     
+    # A user's reports newest-first (My Feedback), and the admin status/priority filters
+    __table_args__ = (
+        db.Index('ix_feedback_user_created', 'user_id', 'created_at'),
+        db.Index('ix_feedback_status_priority', 'status', 'priority'),
+    )
+    
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
@@ -277,36 +403,6 @@ class FeedbackReport(db.Model):
             'steps_to_reproduce': self.steps_to_reproduce
         }
     
-    def get_status_badge(self):
-        """Get HTML badge for status."""
-        badges = {
-            'open': '<span class="badge bg-primary">Open</span>',
-            'in_progress': '<span class="badge bg-warning text-dark">In Progress</span>',
-            'resolved': '<span class="badge bg-success">Resolved</span>',
-            'closed': '<span class="badge bg-secondary">Closed</span>'
-        }
-        return badges.get(self.status, f'<span class="badge bg-light text-dark">{self.status}</span>')
-    
-    def get_priority_badge(self):
-        """Get HTML badge for priority."""
-        badges = {
-            'low': '<span class="badge bg-light text-dark">Low</span>',
-            'medium': '<span class="badge bg-info">Medium</span>',
-            'high': '<span class="badge bg-warning text-dark">High</span>',
-            'critical': '<span class="badge bg-danger">Critical</span>'
-        }
-        return badges.get(self.priority, f'<span class="badge bg-light text-dark">{self.priority}</span>')
-    
-    def get_type_badge(self):
-        """Get HTML badge for report type."""
-        badges = {
-            'bug': '<span class="badge bg-danger"><i class="fas fa-bug me-1"></i>Bug</span>',
-            'feature_request': '<span class="badge bg-success"><i class="fas fa-lightbulb me-1"></i>Feature</span>',
-            'improvement': '<span class="badge bg-primary"><i class="fas fa-arrow-up me-1"></i>Improvement</span>',
-            'other': '<span class="badge bg-secondary"><i class="fas fa-comment me-1"></i>Other</span>'
-        }
-        return badges.get(self.report_type, f'<span class="badge bg-light text-dark">{self.report_type}</span>')
-    
     def __repr__(self):
         return f'<FeedbackReport {self.report_type}: {self.title} by {self.user.username}>'
 
@@ -358,22 +454,36 @@ class GiftCard(db.Model):
         if not is_valid:
             return False, message
         
+        now = datetime.utcnow()
+        subscription_end = now + timedelta(days=30 * self.value_months)
+        
         try:
-            # Mark as redeemed
-            self.is_redeemed = True
-            self.redeemed_by_user_id = user.id
-            self.redeemed_at = datetime.utcnow()
-            self.redeemed_ip = client_ip
+            # Mark as redeemed with a conditional UPDATE, so two concurrent
+            # redemptions of the same card can't both succeed
+            claimed = db.session.execute(
+                update(GiftCard).where(GiftCard.id == self.id, GiftCard.is_redeemed.is_(False)).values(
+                    is_redeemed=True,
+                    redeemed_by_user_id=user.id,
+                    redeemed_at=now,
+                    redeemed_ip=client_ip
+                )
+            ).rowcount
+            if not claimed:
+                db.session.rollback()
+                return False, "Gift card has already been redeemed"
             
             # Grant premium access by updating subscription fields
-            from datetime import timedelta
-            user.subscription_status = 'active'
-            user.subscription_start = datetime.utcnow()
-            user.subscription_end = datetime.utcnow() + timedelta(days=30 * self.value_months)
+            db.session.execute(
+                update(User).where(User.id == user.id).values(
+                    subscription_status='active',
+                    subscription_start=now,
+                    subscription_end=subscription_end
+                )
+            )
             
             db.session.commit()
             
-            return True, f"Gift card redeemed! Premium access granted until {user.subscription_end.strftime('%B %d, %Y')}"
+            return True, f"Gift card redeemed! Premium access granted until {subscription_end.strftime('%B %d, %Y')}"
             
         except Exception as e:
             db.session.rollback()
@@ -394,20 +504,42 @@ class GiftCard(db.Model):
             'created_at': self.created_at.isoformat()
         }
     
+    @staticmethod
+    def normalize_code(code):
+        """Normalize user-entered codes to the stored uppercase form."""
+        return code.strip().upper()
+    
+    # Codes are always stored uppercase, so case-insensitive lookups can
+    # compare normalized input against the plain index on code
+    @validates('code')
+    def _validate_code(self, key, code):
+        return GiftCard.normalize_code(code) if code else code
+    
     @staticmethod
     def generate_code():
-        """Generate a unique gift card code."""
-        import secrets
+        """Generate a random gift card code; uniqueness is enforced on insert."""
         import string
         
         # Generate a secure random code (format: XXXX-XXXX-XXXX)
         chars = string.ascii_uppercase + string.digits
-        while True:
-            code = '-'.join([''.join(secrets.choice(chars) for _ in range(4)) for _ in range(3)])
-            
-            # Ensure code is unique
-            if not GiftCard.query.filter_by(code=code).first():
-                return code
+        return '-'.join([''.join(secrets.choice(chars) for _ in range(4)) for _ in range(3)])
+    
+    def add_with_unique_code(self, max_attempts=5):
+        """Assign a fresh code and add this card to the session, returning the code.
+        
+        The UNIQUE constraint on code does the uniqueness check, so the usual
+        case is one INSERT with no lookup; a collision is rolled back to a
+        savepoint and retried with a new code.
+        """
+        for attempt in range(max_attempts):
+            self.code = GiftCard.generate_code()
+            try:
+                with db.session.begin_nested():
+                    db.session.add(self)
+                return self.code
+            except IntegrityError:
+                if attempt == max_attempts - 1:
+                    raise
     
     def get_status_badge(self):
         """Get HTML badge for redemption status."""
@@ -1,77 +1,227 @@
 import os
-import base64
-import io
-from openai import OpenAI
+import asyncio
+try:
+    import pybase64 as base64  # Optional SIMD-accelerated drop-in for the stdlib module
+except ImportError:
+    import base64
+from openai import AsyncOpenAI
+from llama_client import get_shared_client, LLAMA_BASE_URL
 from dotenv import load_dotenv
 from typing import List, Dict, Tuple, Optional
 import fitz  # PyMuPDF
-from PIL import Image
 import json
+import hashlib
+from functools import lru_cache
+from disk_cache import CACHE_ROOT, load_json, store_json
 
 # Load environment variables
 load_dotenv()
 
+# Section keyword -> insight category, checked in this order (first match wins)
+_INSIGHT_KEYWORDS = (
+    ("engagement", "engagement"),
+    ("assessment", "assessment"),
+    ("differentiation", "differentiation"),
+    ("strength", "strengths"),
+    ("improvement", "improvements"),
+    ("resource", "resources"),
+)
+# Overlay box color and icon per annotation type
+_ANNOTATION_COLORS = {
+    "engagement": (0.2, 0.8, 0.3),     # Bright green
+    "assessment": (0.6, 0.2, 0.8),     # Purple
+    "differentiation": (0.9, 0.5, 0.1), # Orange
+    "strengths": (0.2, 0.5, 0.9),      # Blue
+    "improvements": (0.9, 0.2, 0.2),   # Red
+    "resources": (0.7, 0.7, 0.2),      # Olive
+}
+_ANNOTATION_ICONS = {
+    "engagement": "💡",
+    "assessment": "📊",
+    "differentiation": "🎯",
+    "strengths": "⭐",
+    "improvements": "🔧",
+    "resources": "📦",
+    "general": "💭"
+}
+# Pages analyzed visually by default (pass max_pages=None for all pages)
+MAX_LAYOUT_PAGES = 3
+# Pages rendered and held in memory at once during layout analysis
+RENDER_CHUNK_PAGES = 8
+# Page render transform: 2x zoom for better quality
+_RENDER_MATRIX = fitz.Matrix(2.0, 2.0)
+# Per-page layout placements are cached here, keyed by PDF content, annotations and model
+LAYOUT_CACHE_FOLDER = os.path.join(CACHE_ROOT, "layout")
+
+
+_JSON_DECODER = json.JSONDecoder()
+
+
+def _first_json_value(text: str, opener: str, accept=None):
+    """Decode the first valid JSON value starting at an opener ('{' or '['), or return None.
+    
+    When accept is given, decoded values it rejects are skipped as well.
+    """
+    start = text.find(opener)
+    while start != -1:
+        try:
+            value = _JSON_DECODER.raw_decode(text, start)[0]
+            if accept is None or accept(value):
+                return value
+        except json.JSONDecodeError:
+            pass
+        start = text.find(opener, start + 1)
+    return None
+
+
+@lru_cache(maxsize=4096)
+def _text_width(text: str, font_size: float) -> float:
+    """Rendered width of text in Helvetica ("helv") at font_size, in points."""
+    return fitz.get_text_length(text, fontname="helv", fontsize=font_size)
+
 
 class MultimodalLlamaClient:
     """Enhanced AI client that uses visual analysis for intelligent annotation placement."""
     
-    def __init__(self):
-        self.client = OpenAI(
-            api_key=os.environ.get("LLAMA_API_KEY"),
-            base_url="https://api.llama.com/compat/v1/",
-        )
+    def __init__(self, attach_images: bool = True):
+        self.client = get_shared_client(os.environ.get("LLAMA_API_KEY"))
         self.model = "Llama-4-Maverick-17B-128E-Instruct-FP8"  # Check if this supports vision
-        
-    def analyze_pdf_layout_visually(self, pdf_path: str, annotations_data: Dict) -> List[Dict]:
-        """Analyze PDF layout visually and determine optimal annotation placement."""
-        
-        # Convert PDF pages to images
-        page_images = self._convert_pdf_to_images(pdf_path)
-        
-        # Analyze each page visually
-        placement_instructions = []
-        
-        for page_num, image_data in enumerate(page_images):
-            # Get AI analysis of the page layout
-            layout_analysis = self._analyze_page_layout(image_data, page_num, annotations_data)
-            placement_instructions.append(layout_analysis)
-        
-        return placement_instructions
-    
-    def _convert_pdf_to_images(self, pdf_path: str) -> List[str]:
-        """Convert PDF pages to base64 encoded images."""
-        images = []
+        # Send rendered page images with layout requests (False: text prompt only)
+        self.attach_images = attach_images
+        
+    def analyze_pdf_layout_visually(self, pdf_path: str, annotations_data: Dict, max_concurrency: int = 8,
+                                    force_refresh: bool = False, doc: Optional[fitz.Document] = None,
+                                    batch_size: int = MAX_LAYOUT_PAGES,
+                                    max_pages: Optional[int] = MAX_LAYOUT_PAGES) -> List[Dict]:
+        """Analyze PDF layout visually and determine optimal annotation placement.
+        
+        The first max_pages pages are analyzed (None analyzes every page).
+        Up to batch_size pages share one request carrying all their images;
+        batches that fail fall back to one request per page. Requests overlap
+        and results keep page order. Pages are rendered a chunk at a time and
+        their images dropped once analyzed, so memory stays bounded on long PDFs.
+        Placements returned by the AI are cached per page, so repeat runs on the
+        same PDF and annotations skip rendering and API calls entirely unless
+        force_refresh is set. Callers that already have the PDF open can pass it
+        as doc so it is not parsed a second time.
+        
+        With attach_images every request, batched or per page, carries its page
+        images: about 0.5 MB of base64 PNG per page at 2x zoom, billed as image
+        input tokens on top of the text prompt. A model without vision support
+        rejects these requests and pages get the fallback placement. With
+        attach_images=False pages are not rendered and each page is analyzed by
+        a text-only request, as before images were sent.
+        """
+        
+        if doc is None:
+            try:
+                doc = fitz.open(pdf_path)
+            except Exception as e:
+                print(f"Error reading PDF for layout analysis: {e}")
+                return []
+            with doc:
+                return self.analyze_pdf_layout_visually(pdf_path, annotations_data, max_concurrency,
+                                                        force_refresh, doc=doc, batch_size=batch_size,
+                                                        max_pages=max_pages)
         
         try:
-            doc = fitz.open(pdf_path)
-            
-            for page_num in range(min(len(doc), 3)):  # Limit to first 3 pages for efficiency
-                page = doc[page_num]
+            cache_key = self._layout_cache_key(pdf_path, annotations_data)
+        except OSError as e:
+            print(f"Error reading PDF for layout analysis: {e}")
+            return []
+        page_count = len(doc) if max_pages is None else min(len(doc), max_pages)
+        
+        if force_refresh:
+            results = [None] * page_count
+        else:
+            results = [self._load_cached_layout(cache_key, page_num) for page_num in range(page_count)]
+        missing = [page_num for page_num, placement in enumerate(results) if placement is None]
+        if not missing:
+            return results
+        
+        # Render whole batches per chunk, about RENDER_CHUNK_PAGES pages at a time
+        batch_size = max(batch_size, 1)
+        chunk_size = batch_size * max(1, RENDER_CHUNK_PAGES // batch_size)
+        
+        async def run_all():
+            semaphore = asyncio.Semaphore(max_concurrency)
+            async with AsyncOpenAI(api_key=self.client.api_key, base_url=LLAMA_BASE_URL) as aclient:
+                async def run_one(page_num, image_data):
+                    async with semaphore:
+                        return await self._analyze_page_layout(aclient, image_data, page_num,
+                                                               annotations_data, cache_key)
                 
-                # Render page as image
-                mat = fitz.Matrix(2.0, 2.0)  # 2x zoom for better quality
-                pix = page.get_pixmap(matrix=mat)
+                async def run_batch(batch):
+                    async with semaphore:
+                        placements = await self._analyze_pages_batched(aclient, batch, annotations_data, cache_key)
+                    if placements is None:
+                        batch_results = await asyncio.gather(*(run_one(page_num, image_data)
+                                                               for page_num, image_data in batch))
+                        placements = {page_num: result for (page_num, _), result in zip(batch, batch_results)}
+                    return placements
                 
-                # Convert to PIL Image
-                img_data = pix.tobytes("png")
-                img = Image.open(io.BytesIO(img_data))
+                if not self.attach_images:
+                    # Text-only requests carry no page content, so skip rendering and batching
+                    for page_num, placement in zip(missing, await asyncio.gather(
+                            *(run_one(page_num, None) for page_num in missing))):
+                        results[page_num] = placement
+                    return
                 
-                # Convert to base64
-                buffer = io.BytesIO()
-                img.save(buffer, format='PNG')
-                img_base64 = base64.b64encode(buffer.getvalue()).decode()
+                for chunk_start in range(0, len(missing), chunk_size):
+                    chunk = missing[chunk_start:chunk_start + chunk_size]
+                    
+                    # Convert this chunk's pages to images; pages that fail to
+                    # render are skipped and get fallback placements below
+                    page_images = self._convert_pdf_to_images(doc, chunk)
+                    if not page_images:
+                        continue
+                    
+                    pages = list(zip(chunk, page_images))
+                    batches = [pages[i:i + batch_size] for i in range(0, len(pages), batch_size)]
+                    for placements in await asyncio.gather(*(run_batch(batch) for batch in batches)):
+                        for page_num, placement in placements.items():
+                            results[page_num] = placement
+        
+        # Analyze the uncached pages visually, keeping placements from chunks
+        # that were analyzed even if a later chunk could not be rendered
+        asyncio.run(run_all())
+        if None in results:
+            key_insights = self._extract_key_insights(annotations_data.get('annotations', ''))
+            results = [self._generate_fallback_placement(page_num, key_insights) if placement is None else placement
+                       for page_num, placement in enumerate(results)]
+        return results
+    
+    def _convert_pdf_to_images(self, doc: fitz.Document, page_nums: List[int]) -> List[str]:
+        """Convert the given pages of an open PDF to base64 encoded images.
+        
+        Rendering stays sequential: PyMuPDF does not support use from multiple
+        threads (MuPDF's context is shared, even across separate Documents), so
+        a thread pool risks corrupt output or crashes rather than a speedup.
+        """
+        images = []
+        
+        try:
+            for page_num in page_nums:
+                # Render page as an RGB image (no alpha channel to encode)
+                pix = doc[page_num].get_pixmap(matrix=_RENDER_MATRIX, alpha=False)
                 
-                images.append(img_base64)
+                # Encode the rendered PNG to base64 directly (no PIL decode/re-encode),
+                # and free the raw pixmap before rendering the next page
+                images.append(base64.b64encode(pix.tobytes("png")).decode('ascii'))
+                del pix
             
-            doc.close()
             return images
             
         except Exception as e:
             print(f"Error converting PDF to images: {e}")
             return []
     
-    def _analyze_page_layout(self, image_base64: str, page_num: int, annotations_data: Dict) -> Dict:
-        """Use multimodal AI to analyze page layout and suggest annotation placement."""
+    async def _analyze_page_layout(self, aclient: AsyncOpenAI, image_base64: Optional[str], page_num: int,
+                                   annotations_data: Dict, cache_key: Optional[str] = None) -> Dict:
+        """Use multimodal AI to analyze page layout and suggest annotation placement.
+        
+        The page image is attached when given; None sends the text prompt only.
+        """
         
         # Extract relevant annotations for this analysis
         annotations_text = annotations_data.get('annotations', '')
@@ -79,7 +229,32 @@ class MultimodalLlamaClient:
         # Parse key insights for placement
         key_insights = self._extract_key_insights(annotations_text)
         
-        prompt = f"""
+        prompt = self._layout_prompt(key_insights)
+
+        try:
+            # Note: This is a placeholder for multimodal API call
+            # The actual implementation would depend on Llama's vision capabilities
+            response = await self._make_multimodal_request(aclient, prompt,
+                                                           images=[image_base64] if image_base64 else None)
+            
+            placement = None
+            if response and response.get('success'):
+                placement = self._parse_placement_response(response['content'])
+            if placement is None:
+                # Fallback to basic placement (never cached, so a later run retries)
+                return self._generate_fallback_placement(page_num, key_insights)
+            
+            if cache_key:
+                self._store_cached_layout(cache_key, page_num, placement)
+            return placement
+                
+        except Exception as e:
+            print(f"Error in visual analysis: {e}")
+            return self._generate_fallback_placement(page_num, key_insights)
+    
+    def _layout_prompt(self, key_insights: Dict) -> str:
+        """Build the layout analysis prompt for the given insights."""
+        return f"""
 Analyze this lesson plan page image and provide intelligent annotation placement suggestions.
 
 AVAILABLE INSIGHTS TO PLACE:
@@ -124,32 +299,69 @@ Provide response in this JSON format:
   ]
 }}
 """
-
+    
+    async def _analyze_pages_batched(self, aclient: AsyncOpenAI, pages: List[Tuple[int, str]], annotations_data: Dict,
+                                     cache_key: Optional[str] = None) -> Optional[Dict[int, Dict]]:
+        """Analyze several pages in one request carrying all of their images.
+        
+        Returns placements keyed by page number, or None when the request fails
+        (e.g. the images exceed the model context) or the reply cannot be split
+        per page, so the caller can fall back to one request per page.
+        """
+        key_insights = self._extract_key_insights(annotations_data.get('annotations', ''))
+        page_nums = [page_num for page_num, _ in pages]
+        
+        prompt = self._layout_prompt(key_insights) + f"""
+The {len(pages)} attached images are lesson plan pages {', '.join(map(str, page_nums))}, in that order.
+Analyze each page as described above and respond with a JSON array holding one object per page,
+in the format above plus a "page" field with that page's number.
+"""
+        
+        response = await self._make_multimodal_request(aclient, prompt, images=[image for _, image in pages],
+                                                       max_tokens=1000 * len(pages))
+        if not (response and response.get('success')):
+            return None
+        
+        placements = self._parse_batched_placement_response(response['content'], page_nums)
+        if placements is not None and cache_key:
+            for page_num, placement in placements.items():
+                self._store_cached_layout(cache_key, page_num, placement)
+        return placements
+    
+    def _layout_cache_key(self, pdf_path: str, annotations_data: Dict) -> str:
+        """Cache key for a PDF's layout analysis; changes with the PDF bytes, annotations or model."""
+        digest = hashlib.blake2b(digest_size=16)
+        with open(pdf_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+        digest.update(b'\0' + annotations_data.get('annotations', '').encode('utf-8'))
+        digest.update(b'\0' + self.model.encode('utf-8'))
+        # Visual and text-only analysis give different placements
+        digest.update(b'\0images' if self.attach_images else b'\0text')
+        return digest.hexdigest()
+    
+    def _load_cached_layout(self, cache_key: str, page_num: int) -> Optional[Dict]:
+        """Return a previously cached placement for this page, if any."""
+        return load_json(os.path.join(LAYOUT_CACHE_FOLDER, f"{cache_key}_p{page_num}.json"))
+    
+    def _store_cached_layout(self, cache_key: str, page_num: int, placement: Dict):
+        """Write a page placement to the cache atomically, evicting old entries."""
         try:
-            # Note: This is a placeholder for multimodal API call
-            # The actual implementation would depend on Llama's vision capabilities
-            response = self._make_multimodal_request(prompt, image_base64)
-            
-            if response and response.get('success'):
-                return self._parse_placement_response(response['content'])
-            else:
-                # Fallback to basic placement
-                return self._generate_fallback_placement(page_num, key_insights)
-                
-        except Exception as e:
-            print(f"Error in visual analysis: {e}")
-            return self._generate_fallback_placement(page_num, key_insights)
+            store_json(os.path.join(LAYOUT_CACHE_FOLDER, f"{cache_key}_p{page_num}.json"), placement)
+        except OSError as e:
+            print(f"Warning: Could not cache layout analysis: {e}")
     
-    def _make_multimodal_request(self, prompt: str, image_base64: str) -> Dict:
-        """Make multimodal API request to Llama."""
+    async def _make_multimodal_request(self, aclient: AsyncOpenAI, prompt: str, images: Optional[List[str]] = None,
+                                       max_tokens: int = 1000) -> Dict:
+        """Make multimodal API request to Llama.
+        
+        Base64 PNGs passed in images are attached to the user message as data
+        URLs; without images the prompt is sent as plain text. Rate-limit and
+        timeout errors are retried with exponential backoff by the OpenAI
+        client itself (max_retries).
+        """
         try:
-            # Check if the model supports vision
-            # This is a placeholder - actual implementation depends on Llama's capabilities
-            
-            # For now, we'll use text-only analysis with image dimensions
-            # In a real multimodal implementation, this would include the image
-            
-            response = self.client.chat.completions.create(
+            response = await aclient.chat.completions.create(
                 model=self.model,
                 messages=[
                     {
@@ -158,11 +370,14 @@ Provide response in this JSON format:
                     },
                     {
                         "role": "user", 
-                        "content": prompt
+                        "content": [{"type": "text", "text": prompt}] + [
+                            {"type": "image_url", "image_url": {"url": f"data:image/png;base64,{image}"}}
+                            for image in images
+                        ] if images else prompt
                     }
                 ],
                 temperature=0.3,
-                max_tokens=1000
+                max_tokens=max_tokens
             )
             
             return {
@@ -176,40 +391,23 @@ Provide response in this JSON format:
     
     def _extract_key_insights(self, annotations_text: str) -> Dict:
         """Extract key insights from annotations for placement."""
-        insights = {
-            "engagement": [],
-            "assessment": [],
-            "differentiation": [],
-            "strengths": [],
-            "improvements": [],
-            "resources": []
-        }
+        insights = {category: [] for _, category in _INSIGHT_KEYWORDS}
         
-        # Parse annotations into categories
-        sections = annotations_text.split('###')
-        
-        for section in sections:
-            if 'engagement' in section.lower():
-                insights["engagement"] = self._extract_bullets(section)[:2]
-            elif 'assessment' in section.lower():
-                insights["assessment"] = self._extract_bullets(section)[:2]
-            elif 'differentiation' in section.lower():
-                insights["differentiation"] = self._extract_bullets(section)[:2]
-            elif 'strength' in section.lower():
-                insights["strengths"] = self._extract_bullets(section)[:2]
-            elif 'improvement' in section.lower():
-                insights["improvements"] = self._extract_bullets(section)[:2]
-            elif 'resource' in section.lower():
-                insights["resources"] = self._extract_bullets(section)[:2]
+        # Parse annotations into categories, lowering each section once
+        for section in annotations_text.split('###'):
+            lowered = section.lower()
+            for keyword, category in _INSIGHT_KEYWORDS:
+                if keyword in lowered:
+                    insights[category] = self._extract_bullets(section, limit=2)
+                    break
         
         return insights
     
-    def _extract_bullets(self, text: str) -> List[str]:
-        """Extract bullet points from text section."""
-        lines = text.split('\n')
+    def _extract_bullets(self, text: str, limit: Optional[int] = None) -> List[str]:
+        """Extract bullet points from text section, stopping after limit bullets."""
         bullets = []
         
-        for line in lines:
+        for line in text.split('\n'):
             line = line.strip()
             if line.startswith(('-', '•', '*')) or line[0:1].isdigit():
                 clean_line = line.lstrip('-•*0123456789. ').strip()
@@ -218,23 +416,33 @@ Provide response in this JSON format:
                     if len(clean_line) > 60:
                         clean_line = clean_line[:57] + "..."
                     bullets.append(clean_line)
+                    if len(bullets) == limit:
+                        break
         
         return bullets
     
-    def _parse_placement_response(self, response_text: str) -> Dict:
-        """Parse AI response into placement instructions."""
-        try:
-            # Try to extract JSON from response
-            if '{' in response_text:
-                json_start = response_text.find('{')
-                json_end = response_text.rfind('}') + 1
-                json_text = response_text[json_start:json_end]
-                return json.loads(json_text)
-        except:
-            pass
+    def _parse_placement_response(self, response_text: str) -> Optional[Dict]:
+        """Parse AI response into placement instructions, or None when it holds no JSON object."""
+        # First JSON object in the reply, skipping prose and markdown fences
+        return _first_json_value(response_text, '{', accept=lambda value: isinstance(value, dict))
+    
+    def _parse_batched_placement_response(self, response_text: str, page_nums: List[int]) -> Optional[Dict[int, Dict]]:
+        """Split a batched JSON array reply into placements keyed by page number."""
+        items = _first_json_value(
+            response_text, '[',
+            accept=lambda value: isinstance(value, list) and all(
+                isinstance(item, dict) and 'annotation_placements' in item for item in value)
+        )
+        if items is None:
+            return None
         
-        # Fallback parsing if JSON fails
-        return self._generate_fallback_placement(0, {})
+        # Prefer the page numbers the model echoed back, else rely on order
+        by_page = {item.get('page'): item for item in items}
+        if all(page_num in by_page for page_num in page_nums):
+            return {page_num: by_page[page_num] for page_num in page_nums}
+        if len(items) == len(page_nums):
+            return dict(zip(page_nums, items))
+        return None
     
     def _generate_fallback_placement(self, page_num: int, insights: Dict) -> Dict:
         """Generate fallback placement when AI analysis fails."""
@@ -282,8 +490,14 @@ class IntelligentOverlayAnnotator:
         self.multimodal_client = MultimodalLlamaClient()
         self.doc = None
     
-    def create_intelligent_overlay_pdf(self, annotations_data: Dict, output_filename: str = None) -> str:
-        """Create PDF with intelligently placed annotation overlays."""
+    def create_intelligent_overlay_pdf(self, annotations_data: Dict, output_filename: str = None,
+                                       force_refresh: bool = False,
+                                       max_pages: Optional[int] = MAX_LAYOUT_PAGES) -> str:
+        """Create PDF with intelligently placed annotation overlays.
+        
+        The first max_pages pages are annotated (None for all). Cached layout
+        analysis is reused unless force_refresh is set.
+        """
         
         if output_filename is None:
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
@@ -296,7 +510,8 @@ class IntelligentOverlayAnnotator:
             # Get intelligent placement instructions
             print("🧠 Analyzing PDF layout with multimodal AI...")
             placement_instructions = self.multimodal_client.analyze_pdf_layout_visually(
-                self.original_pdf_path, annotations_data
+                self.original_pdf_path, annotations_data, force_refresh=force_refresh, doc=self.doc,
+                max_pages=max_pages
             )
             
             # Apply intelligent annotations
@@ -318,15 +533,6 @@ class IntelligentOverlayAnnotator:
     def _apply_intelligent_annotations(self, placement_instructions: List[Dict]):
         """Apply annotations based on intelligent placement analysis."""
         
-        color_map = {
-            "engagement": (0.2, 0.8, 0.3),     # Bright green
-            "assessment": (0.6, 0.2, 0.8),     # Purple  
-            "differentiation": (0.9, 0.5, 0.1), # Orange
-            "strengths": (0.2, 0.5, 0.9),      # Blue
-            "improvements": (0.9, 0.2, 0.2),   # Red
-            "resources": (0.7, 0.7, 0.2),      # Olive
-        }
-        
         for page_num, page_instructions in enumerate(placement_instructions):
             if page_num < len(self.doc):
                 page = self.doc[page_num]
@@ -334,9 +540,9 @@ class IntelligentOverlayAnnotator:
                 placements = page_instructions.get("annotation_placements", [])
                 
                 for placement in placements:
-                    self._add_intelligent_annotation(page, placement, color_map)
+                    self._add_intelligent_annotation(page, placement)
     
-    def _add_intelligent_annotation(self, page, placement: Dict, color_map: Dict):
+    def _add_intelligent_annotation(self, page, placement: Dict):
         """Add a single intelligent annotation to the page."""
         
         x = placement.get("x", 400)
@@ -347,7 +553,7 @@ class IntelligentOverlayAnnotator:
         text = placement.get("text", "AI Insight")
         
         # Get color for annotation type
-        color = color_map.get(annotation_type, (0.5, 0.5, 0.5))
+        color = _ANNOTATION_COLORS.get(annotation_type, (0.5, 0.5, 0.5))
         
         # Create annotation rectangle
         rect = fitz.Rect(x, y, x + width, y + height)
@@ -371,42 +577,40 @@ class IntelligentOverlayAnnotator:
     
     def _get_annotation_icon(self, annotation_type: str) -> str:
         """Get appropriate icon for annotation type."""
-        icons = {
-            "engagement": "💡",
-            "assessment": "📊", 
-            "differentiation": "🎯",
-            "strengths": "⭐",
-            "improvements": "🔧",
-            "resources": "📦",
-            "general": "💭"
-        }
-        return icons.get(annotation_type, "💭")
+        return _ANNOTATION_ICONS.get(annotation_type, "💭")
     
     def _add_wrapped_text(self, page, text: str, rect: fitz.Rect):
         """Add wrapped text to annotation box."""
-        words = text.split()
+        font_size = 7
+        max_lines = 5
         lines = []
         current_line = ""
+        current_width = 0.0
         max_width = rect.width - 10
-        
-        for word in words:
-            test_line = current_line + (" " if current_line else "") + word
-            if len(test_line) * 5 < max_width:  # Rough character width
-                current_line = test_line
+        space_width = _text_width(" ", font_size)
+        
+        # Greedy wrap using real Helvetica widths, summed per word
+        for word in text.split():
+            word_width = _text_width(word, font_size)
+            if current_line and current_width + space_width + word_width < max_width:
+                current_line += " " + word
+                current_width += space_width + word_width
             else:
                 if current_line:
                     lines.append(current_line)
+                    if len(lines) == max_lines:
+                        break
                 current_line = word
-        
-        if current_line:
-            lines.append(current_line)
+                current_width = word_width
+        else:
+            if current_line:
+                lines.append(current_line)
         
         # Add lines to PDF
-        font_size = 7
         line_height = 9
         y_offset = 8
         
-        for line in lines[:5]:  # Limit lines
+        for line in lines[:max_lines]:  # Limit lines
             if y_offset + line_height > rect.height - 5:
                 break
             
@@ -1,4 +1,6 @@
-import io
+import os
+import shutil
+import tempfile
 from datetime import datetime
 from typing import Dict, List
 from reportlab.pdfgen import canvas
@@ -8,10 +10,42 @@ from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, PageBreak
 from reportlab.lib.units import inch
 from reportlab.lib.enums import TA_LEFT, TA_JUSTIFY
-import PyPDF2
+import fitz  # PyMuPDF
 import json
 
 
+# Paragraph styles are immutable in use, so build them once at import time
+_STYLES = getSampleStyleSheet()
+
+_TITLE_STYLE = ParagraphStyle(
+    'CustomTitle',
+    parent=_STYLES['Heading1'],
+    fontSize=16,
+    spaceAfter=30,
+    textColor=blue,
+    alignment=TA_LEFT
+)
+
+_SECTION_STYLE = ParagraphStyle(
+    'CustomSection',
+    parent=_STYLES['Heading2'],
+    fontSize=12,
+    spaceBefore=15,
+    spaceAfter=10,
+    textColor=red,
+    alignment=TA_LEFT
+)
+
+_BODY_STYLE = ParagraphStyle(
+    'CustomBody',
+    parent=_STYLES['Normal'],
+    fontSize=10,
+    spaceAfter=8,
+    alignment=TA_JUSTIFY,
+    leftIndent=0.2*inch
+)
+
+
 class PDFAnnotationGenerator:
     """Generate annotated PDF with AI insights overlaid on original lesson plan."""
     
@@ -30,19 +64,23 @@ class PDFAnnotationGenerator:
         self.output_path = output_filename
         self.annotations = annotations_data
         
-        # Create the annotation document
-        annotation_buffer = io.BytesIO()
-        self._create_annotation_document(annotation_buffer)
-        
-        # Combine with original PDF
-        self._combine_pdfs(annotation_buffer, output_filename)
+        # Create the annotation document in a scratch file rather than in memory
+        fd, annotation_path = tempfile.mkstemp(suffix='.pdf')
+        os.close(fd)
+        try:
+            self._create_annotation_document(annotation_path)
+            
+            # Combine with original PDF
+            self._combine_pdfs(annotation_path, output_filename)
+        finally:
+            os.remove(annotation_path)
         
         return output_filename
     
-    def _create_annotation_document(self, buffer):
+    def _create_annotation_document(self, output_path: str):
         """Create a comprehensive annotation document."""
         doc = SimpleDocTemplate(
-            buffer,
+            output_path,
             pagesize=letter,
             rightMargin=0.5*inch,
             leftMargin=0.5*inch,
@@ -50,47 +88,17 @@ class PDFAnnotationGenerator:
             bottomMargin=0.75*inch
         )
         
-        # Define styles
-        styles = getSampleStyleSheet()
-        title_style = ParagraphStyle(
-            'CustomTitle',
-            parent=styles['Heading1'],
-            fontSize=16,
-            spaceAfter=30,
-            textColor=blue,
-            alignment=TA_LEFT
-        )
-        
-        section_style = ParagraphStyle(
-            'CustomSection',
-            parent=styles['Heading2'],
-            fontSize=12,
-            spaceBefore=15,
-            spaceAfter=10,
-            textColor=red,
-            alignment=TA_LEFT
-        )
-        
-        body_style = ParagraphStyle(
-            'CustomBody',
-            parent=styles['Normal'],
-            fontSize=10,
-            spaceAfter=8,
-            alignment=TA_JUSTIFY,
-            leftIndent=0.2*inch
-        )
-        
         # Build the story
         story = []
         
         # Title page
-        story.append(Paragraph("🎓 AI LESSON PLAN ANNOTATIONS", title_style))
+        story.append(Paragraph("🎓 AI LESSON PLAN ANNOTATIONS", _TITLE_STYLE))
         story.append(Spacer(1, 0.2*inch))
         
         # Lesson info
         if 'lesson_info' in self.annotations:
             info = self.annotations['lesson_info']
-            story.append(Paragraph("📋 LESSON INFORMATION", section_style))
+            story.append(Paragraph("📋 LESSON INFORMATION", _SECTION_STYLE))
             
             lesson_details = f"""
             <b>PDF File:</b> {info.get('pdf_path', 'N/A')}<br/>
@@ -99,12 +107,12 @@ class PDFAnnotationGenerator:
             <b>Grade Level:</b> {info.get('structure', {}).get('grade_level', 'N/A')}<br/>
             <b>Week/Day:</b> {info.get('structure', {}).get('week', 'N/A')}
             """
-            story.append(Paragraph(lesson_details, body_style))
+            story.append(Paragraph(lesson_details, _BODY_STYLE))
             story.append(Spacer(1, 0.2*inch))
         
         # Main annotations
         if 'annotations' in self.annotations:
-            story.append(Paragraph("🤖 AI ANALYSIS & RECOMMENDATIONS", title_style))
+            story.append(Paragraph("🤖 AI ANALYSIS & RECOMMENDATIONS", _TITLE_STYLE))
             story.append(Spacer(1, 0.1*inch))
             
             # Parse and format the annotations
@@ -112,28 +120,27 @@ class PDFAnnotationGenerator:
             sections = self._parse_annotation_sections(annotation_text)
             
             for section_title, content in sections.items():
-                story.append(Paragraph(section_title, section_style))
+                story.append(Paragraph(section_title, _SECTION_STYLE))
                 
                 # Process content to handle lists and formatting
                 formatted_content = self._format_content(content)
-                story.append(Paragraph(formatted_content, body_style))
+                story.append(Paragraph(formatted_content, _BODY_STYLE))
                 story.append(Spacer(1, 0.1*inch))
         
         # Usage statistics
         if 'usage' in self.annotations:
             story.append(PageBreak())
-            story.append(Paragraph("📊 ANALYSIS STATISTICS", section_style))
+            story.append(Paragraph("📊 ANALYSIS STATISTICS", _SECTION_STYLE))
             usage = self.annotations['usage']
             usage_text = f"""
             <b>Prompt Tokens:</b> {usage.get('prompt_tokens', 'N/A')}<br/>
             <b>Completion Tokens:</b> {usage.get('completion_tokens', 'N/A')}<br/>
             <b>Total Tokens:</b> {usage.get('total_tokens', 'N/A')}
             """
-            story.append(Paragraph(usage_text, body_style))
+            story.append(Paragraph(usage_text, _BODY_STYLE))
         
         # Build the PDF
         doc.build(story)
-        buffer.seek(0)
     
     def _parse_annotation_sections(self, text: str) -> Dict[str, str]:
         """Parse annotation text into sections."""
@@ -190,34 +197,24 @@ class PDFAnnotationGenerator:
         
         return '<br/>'.join(formatted_lines)
     
-    def _combine_pdfs(self, annotation_buffer, output_filename: str):
+    def _combine_pdfs(self, annotation_path: str, output_filename: str):
         """Combine the original PDF with annotations."""
         try:
-            # Read the original PDF
-            with open(self.original_pdf_path, 'rb') as original_file:
-                original_reader = PyPDF2.PdfReader(original_file)
-                annotation_reader = PyPDF2.PdfReader(annotation_buffer)
-                
-                writer = PyPDF2.PdfWriter()
-                
-                # Add original pages first
-                for page in original_reader.pages:
-                    writer.add_page(page)
-                
-                # Add annotation pages
-                for page in annotation_reader.pages:
-                    writer.add_page(page)
+            # PyMuPDF copies page objects in C instead of rewriting them in Python
+            with fitz.open(self.original_pdf_path) as original_doc, \
+                    fitz.open(annotation_path) as annotation_doc, \
+                    fitz.open() as combined_doc:
+                # Original pages first, then the annotation pages
+                combined_doc.insert_pdf(original_doc)
+                combined_doc.insert_pdf(annotation_doc)
                 
                 # Write the combined PDF
-                with open(output_filename, 'wb') as output_file:
-                    writer.write(output_file)
+                combined_doc.save(output_filename, garbage=3, deflate=True)
                     
         except Exception as e:
             # If combining fails, just save the annotation document
             print(f"Warning: Could not combine PDFs ({e}). Saving annotations only.")
-            annotation_buffer.seek(0)
-            with open(output_filename, 'wb') as output_file:
-                output_file.write(annotation_buffer.read())
+            shutil.copyfile(annotation_path, output_filename)
     
     def create_side_by_side_pdf(self, annotations_data: Dict, output_filename: str = None) -> str:
         """Create a side-by-side view with original and annotations."""
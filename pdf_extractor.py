@@ -1,30 +1,111 @@
-import PyPDF2
-from typing import List, Dict
+import os
+import re
+import hashlib
+from collections import Counter
+import fitz  # PyMuPDF
+import pypdf
+from typing import List, Dict, Optional
+from disk_cache import CACHE_ROOT, load_json, store_json
+
+# Runs of horizontal whitespace inside a line
+_WS_RE = re.compile(r'[^\S\n]+')
+# Page numbers and other digits, ignored when matching repeated headers/footers
+_DIGITS_RE = re.compile(r'\d+')
+# Lines at the top and bottom of each page checked for repeated headers/footers
+_EDGE_LINES = 3
+# Character budget for the AI prompt (~12k tokens at ~4 characters per token)
+MAX_PROMPT_CHARS = 48000
+# Extracted page text is cached here (when enabled), keyed by PDF content and backend
+PDF_TEXT_CACHE_FOLDER = os.path.join(CACHE_ROOT, "pdf_text")
+
+
+def compact_lesson_text(pages: List[str], max_chars: int = MAX_PROMPT_CHARS) -> str:
+    """Shrink extracted page text for the AI prompt.
+    
+    Collapses whitespace, drops blank lines, keeps only the first copy of
+    headers/footers that repeat at the edges of at least three pages, and caps
+    the result at max_chars.
+    """
+    page_lines = [[line for line in (_WS_RE.sub(' ', raw).strip() for raw in page.split('\n')) if line]
+                  for page in pages]
+    
+    # Count each edge line once per page, ignoring digits (page numbers)
+    edge_counts = Counter()
+    for lines in page_lines:
+        edges = lines[:_EDGE_LINES] + lines[_EDGE_LINES:][-_EDGE_LINES:]
+        edge_counts.update({_DIGITS_RE.sub('#', line) for line in edges})
+    boilerplate = {key for key, count in edge_counts.items() if count >= 3}
+    
+    seen = set()
+    kept = []
+    for lines in page_lines:
+        for i, line in enumerate(lines):
+            if i < _EDGE_LINES or i >= len(lines) - _EDGE_LINES:
+                key = _DIGITS_RE.sub('#', line)
+                if key in boilerplate:
+                    if key in seen:
+                        continue
+                    seen.add(key)
+            kept.append(line)
+    
+    return '\n'.join(kept)[:max_chars]
 
 
 class PDFExtractor:
     """Extract text and structure from PDF lesson plans."""
     
-    def __init__(self, pdf_path: str):
+    def __init__(self, pdf_path: str, backend: str = "pymupdf", use_cache: bool = False):
         self.pdf_path = pdf_path
+        self.backend = backend  # "pymupdf" (fast, default) or "pypdf"
+        # Opt-in: cached text outlives the PDF, so only enable it for local files
+        # (e.g. the CLI), never for uploads that are deleted after processing
+        self.use_cache = use_cache
         self.pages_text = []
         
     def extract_text(self) -> List[str]:
-        """Extract text from all pages of the PDF."""
+        """Extract text from all pages of the PDF.
+        
+        Pages are read sequentially: PyMuPDF documents are not thread-safe and
+        hold the GIL, so a thread pool over pages cannot speed this up.
+        """
         try:
-            with open(self.pdf_path, 'rb') as file:
-                pdf_reader = PyPDF2.PdfReader(file)
-                
-                for page_num in range(len(pdf_reader.pages)):
-                    page = pdf_reader.pages[page_num]
-                    text = page.extract_text()
-                    self.pages_text.append(text)
-                    
+            cache_path = self._cache_path() if self.use_cache else None
+            cached = load_json(cache_path) if cache_path else None
+            if cached:
+                self.pages_text.extend(cached)
+                return self.pages_text
+            
+            if self.backend == "pypdf":
+                with open(self.pdf_path, 'rb') as file:
+                    pdf_reader = pypdf.PdfReader(file)
+                    self.pages_text.extend(page.extract_text() for page in pdf_reader.pages)
+            else:
+                with fitz.open(self.pdf_path) as doc:
+                    self.pages_text.extend(page.get_text("text") for page in doc)
+            
+            if self.pages_text and cache_path:
+                self._store_cached(cache_path, self.pages_text)
             return self.pages_text
         except Exception as e:
             print(f"Error extracting PDF text: {e}")
             return []
     
+    def _cache_path(self) -> str:
+        """Cache file for this PDF; keyed by its bytes, so any copy of the same file hits."""
+        digest = hashlib.blake2b(digest_size=16)
+        with open(self.pdf_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+        digest.update(b'\0' + self.backend.encode('utf-8'))
+        return os.path.join(PDF_TEXT_CACHE_FOLDER, f"{digest.hexdigest()}.json")
+    
+    def _store_cached(self, cache_path: str, pages: List[str]):
+        """Write extracted page text to the cache atomically, evicting old entries."""
+        try:
+            store_json(cache_path, pages)
+        except OSError as e:
+            print(f"Warning: Could not cache extracted PDF text: {e}")
+    
     def get_lesson_structure(self) -> Dict:
         """Analyze the lesson plan structure and extract key components."""
         if not self.pages_text:
@@ -44,10 +125,10 @@ class PDFExtractor:
         # Extract structure from first page if available
         if self.pages_text:
             first_page = self.pages_text[0]
+            lines = first_page.split('\n')  # Split once, shared by every lookup below
             
             # Extract week and day
             if "SEMANA" in first_page and "Día" in first_page:
-                lines = first_page.split('\n')
                 for line in lines:
                     if "SEMANA" in line and "Día" in line:
                         structure["week"] = line.strip()
@@ -55,7 +136,6 @@ class PDFExtractor:
             
             # Extract grade level
             if "Grado" in first_page:
-                lines = first_page.split('\n')
                 for line in lines:
                     if "Grado" in line:
                         structure["grade_level"] = line.strip()
@@ -63,7 +143,6 @@ class PDFExtractor:
             
             # Extract objectives
             if "Objetivos del estudiante" in first_page:
-                lines = first_page.split('\n')
                 in_objectives = False
                 for line in lines:
                     if "Objetivos del estudiante" in line:
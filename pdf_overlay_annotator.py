@@ -4,6 +4,33 @@ import re
 from datetime import datetime
 from typing import Dict, List, Tuple, Optional
 from dataclasses import dataclass
+from functools import lru_cache
+
+
+# Markdown characters stripped from annotation bullet points; bullet hyphens are
+# only trimmed from the ends so hyphenated words like "hands-on" survive
+_BULLET_STRIP = str.maketrans('', '', '*#')
+_BULLET_EDGES = ' \t-'
+
+# Page keywords (lowercase) with the annotation type and label they suggest, checked in order
+_KEYWORD_ANNOTATIONS = (
+    ("objectives", "engagement", "💡 Engagement Boost"),
+    ("objetivos", "engagement", "💡 Engagement Boost"),
+    ("materials", "resources", "🔧 Resource Tip"),
+    ("materiales", "resources", "🔧 Resource Tip"),
+    ("actividad", "differentiation", "🎯 Differentiation"),
+    ("activity", "differentiation", "🎯 Differentiation"),
+    ("evaluación", "assessment", "📊 Assessment Idea"),
+    ("assessment", "assessment", "📊 Assessment Idea"),
+    ("phonological", "strengths", "⭐ Strength"),
+    ("fonológica", "strengths", "⭐ Strength"),
+)
+
+
+@lru_cache(maxsize=4096)
+def _text_width(text: str, font_size: float) -> float:
+    """Rendered width of text in Helvetica ("helv") at font_size, in points."""
+    return fitz.get_text_length(text, fontname="helv", fontsize=font_size)
 
 
 @dataclass
@@ -80,14 +107,13 @@ class PDFOverlayAnnotator:
         # Process each page
         for page_num in range(len(self.doc)):
             page = self.doc[page_num]
-            page_rect = page.rect
             
-            # Get text blocks from the page
-            text_blocks = page.get_text("dict")
+            # Extract the page text once, lowercased for keyword matching
+            page_text = page.get_text().lower()
             
             # Find annotation opportunities on this page
             page_annotations = self._find_annotation_positions(
-                page, text_blocks, parsed_annotations, page_num
+                page, page_text, parsed_annotations, page_num
             )
             
             annotation_boxes.extend(page_annotations)
@@ -99,68 +125,75 @@ class PDFOverlayAnnotator:
         if 'annotations' not in self.annotations:
             return {}
         
-        annotation_text = self.annotations['annotations']
+        # Scan and clean the text once; each section then only walks the headers
+        blocks = self._split_header_blocks(self.annotations['annotations'])
         
         parsed = {
-            "strengths": self._extract_bullet_points(annotation_text, "Pedagogical Strengths"),
-            "engagement": self._extract_bullet_points(annotation_text, "Student Engagement"),
-            "assessment": self._extract_bullet_points(annotation_text, "Assessment"),
-            "differentiation": self._extract_bullet_points(annotation_text, "Differentiation"),
-            "improvement": self._extract_bullet_points(annotation_text, "Areas for Improvement"),
-            "resources": self._extract_bullet_points(annotation_text, "Resource Optimization"),
-            "extension": self._extract_bullet_points(annotation_text, "Extension Activities"),
-            "cultural": self._extract_bullet_points(annotation_text, "Cultural")
+            "strengths": self._extract_bullet_points(blocks, "Pedagogical Strengths"),
+            "engagement": self._extract_bullet_points(blocks, "Student Engagement"),
+            "assessment": self._extract_bullet_points(blocks, "Assessment"),
+            "differentiation": self._extract_bullet_points(blocks, "Differentiation"),
+            "improvement": self._extract_bullet_points(blocks, "Areas for Improvement"),
+            "resources": self._extract_bullet_points(blocks, "Resource Optimization"),
+            "extension": self._extract_bullet_points(blocks, "Extension Activities"),
+            "cultural": self._extract_bullet_points(blocks, "Cultural")
         }
         
         return parsed
     
-    def _extract_bullet_points(self, text: str, section_name: str) -> List[str]:
-        """Extract bullet points from a specific section."""
-        lines = text.split('\n')
-        in_section = False
-        bullet_points = []
+    def _split_header_blocks(self, text: str) -> List[Tuple[str, List[str]]]:
+        """Split text at header lines (containing ** or ##) into (lowered header, bullet points) blocks.
+        
+        Lines before the first header are dropped.
+        """
+        blocks = []
+        bullet_points = None
         
-        for line in lines:
+        for line in text.split('\n'):
             line = line.strip()
             
-            if section_name.lower() in line.lower() and ('**' in line or '##' in line):
-                in_section = True
-                continue
-            elif in_section and ('**' in line or '##' in line) and section_name.lower() not in line.lower():
-                break
-            elif in_section and line:
+            if '**' in line or '##' in line:
+                bullet_points = []
+                blocks.append((line.lower(), bullet_points))
+            elif bullet_points is not None and line:
                 # Clean bullet point
-                clean_line = line.replace('*', '').replace('#', '').replace('-', '').strip()
-                if clean_line and len(clean_line) > 10:
+                clean_line = line.translate(_BULLET_STRIP).strip(_BULLET_EDGES)
+                if len(clean_line) > 10:
                     # Truncate for overlay display
                     if len(clean_line) > 80:
                         clean_line = clean_line[:77] + "..."
                     bullet_points.append(clean_line)
         
+        return blocks
+    
+    def _extract_bullet_points(self, blocks: List[Tuple[str, List[str]]], section_name: str) -> List[str]:
+        """Extract bullet points from a specific section.
+        
+        The section starts at the first header naming it and runs until a
+        header that does not.
+        """
+        section_name = section_name.lower()
+        in_section = False
+        bullet_points = []
+        
+        for header, header_bullets in blocks:
+            if section_name in header:
+                in_section = True
+            elif in_section:
+                break
+            
+            if in_section:
+                bullet_points.extend(header_bullets)
+                if len(bullet_points) >= 2:
+                    break
+        
         return bullet_points[:2]  # Limit to 2 per section for space
     
-    def _find_annotation_positions(self, page, text_blocks: Dict, annotations: Dict, page_num: int) -> List[AnnotationBox]:
-        """Find smart positions for annotations on a page."""
+    def _find_annotation_positions(self, page, page_text: str, annotations: Dict, page_num: int) -> List[AnnotationBox]:
+        """Find smart positions for annotations on a page, given its lowercased text."""
         boxes = []
         page_rect = page.rect
         
-        # Get text content for keyword matching
-        page_text = page.get_text().lower()
-        
-        # Keywords that suggest different annotation types
-        keyword_mapping = {
-            "objectives": ("engagement", "💡 Engagement Boost"),
-            "objetivos": ("engagement", "💡 Engagement Boost"),
-            "materials": ("resources", "🔧 Resource Tip"),
-            "materiales": ("resources", "🔧 Resource Tip"), 
-            "actividad": ("differentiation", "🎯 Differentiation"),
-            "activity": ("differentiation", "🎯 Differentiation"),
-            "evaluación": ("assessment", "📊 Assessment Idea"),
-            "assessment": ("assessment", "📊 Assessment Idea"),
-            "phonological": ("strengths", "⭐ Strength"),
-            "fonológica": ("strengths", "⭐ Strength"),
-        }
-        
         # Find available annotation space (margins)
         margin_width = 150
         annotation_height = 60
@@ -174,8 +207,10 @@ class PDFOverlayAnnotator:
         annotations_added = 0
         max_annotations_per_page = 4
         
-        for keyword, (annotation_type, prefix) in keyword_mapping.items():
-            if keyword in page_text and annotations_added < max_annotations_per_page:
+        for keyword, annotation_type, prefix in _KEYWORD_ANNOTATIONS:
+            if annotations_added >= max_annotations_per_page:
+                break
+            if keyword in page_text:
                 insights = annotations.get(annotation_type, [])
                 if insights:
                     # Take first available insight
@@ -221,62 +256,72 @@ class PDFOverlayAnnotator:
             if page_num < len(self.doc):
                 page = self.doc[page_num]
                 
+                # Draw the whole box into one shape so it is committed to the
+                # page once, keeping each box's text above its own rectangles
+                shape = page.new_shape()
+                
                 # Create annotation rectangle
                 rect = fitz.Rect(box.x, box.y, box.x + box.width, box.y + box.height)
                 
                 # Add colored background rectangle
-                page.draw_rect(rect, color=box.color, fill=box.color, width=0)
+                shape.draw_rect(rect)
+                shape.finish(color=box.color, fill=box.color, width=0)
                 
                 # Add semi-transparent white background for text readability
                 text_rect = fitz.Rect(box.x + 2, box.y + 2, box.x + box.width - 2, box.y + box.height - 2)
-                page.draw_rect(text_rect, color=(1, 1, 1), fill=(1, 1, 1), width=0)
+                shape.draw_rect(text_rect)
+                shape.finish(color=(1, 1, 1), fill=(1, 1, 1), width=0)
                 
                 # Add border
-                page.draw_rect(rect, color=box.color, fill=None, width=1)
+                shape.draw_rect(rect)
+                shape.finish(color=box.color, fill=None, width=1)
                 
                 # Add text
-                self._add_text_to_box(page, box)
+                self._add_text_to_box(shape, box)
+                shape.commit()
     
     def _add_text_to_box(self, page, box: AnnotationBox):
-        """Add wrapped text to an annotation box."""
+        """Add wrapped text to an annotation box.
+        
+        page may be a fitz.Page or a fitz.Shape; both provide insert_textbox.
+        """
         # Calculate text area
         text_rect = fitz.Rect(box.x + 5, box.y + 5, box.x + box.width - 5, box.y + box.height - 5)
+        font_size = 8
+        max_lines = 4
         
-        # Split text into lines that fit
-        words = box.text.split()
+        # Wrap with real Helvetica widths so every line fits, capped at max_lines;
+        # insert_textbox writes nothing at all if its text overflows the box
         lines = []
         current_line = ""
+        current_width = 0.0
+        space_width = _text_width(" ", font_size)
         
-        for word in words:
-            test_line = current_line + (" " if current_line else "") + word
-            if len(test_line) * 6 < box.width - 10:  # Rough character width estimation
-                current_line = test_line
+        for word in box.text.split():
+            word_width = _text_width(word, font_size)
+            if current_line and current_width + space_width + word_width <= text_rect.width:
+                current_line += " " + word
+                current_width += space_width + word_width
             else:
                 if current_line:
                     lines.append(current_line)
+                    if len(lines) == max_lines:
+                        break
                 current_line = word
+                current_width = word_width
+        else:
+            if current_line:
+                lines.append(current_line)
         
-        if current_line:
-            lines.append(current_line)
-        
-        # Add lines to PDF
-        font_size = 8
-        line_height = 10
-        y_offset = 0
-        
-        for i, line in enumerate(lines[:4]):  # Limit to 4 lines
-            if y_offset + line_height > box.height - 10:
-                break
-                
-            text_point = fitz.Point(box.x + 5, box.y + 15 + y_offset)
-            page.insert_text(
-                text_point,
-                line,
-                fontsize=font_size,
-                color=(0, 0, 0),  # Black text
-                fontname="helv"
-            )
-            y_offset += line_height
+        # Lay the lines out in one MuPDF call, dropping any that do not fit the height
+        while lines and page.insert_textbox(
+            text_rect,
+            "\n".join(lines),
+            fontsize=font_size,
+            color=(0, 0, 0),  # Black text
+            fontname="helv"
+        ) < 0:
+            lines.pop()
     
     def _distribute_annotations_across_pages(self, annotation_boxes: List[AnnotationBox]):
         """Distribute annotations across multiple pages if needed."""
@@ -27,10 +27,11 @@ def check_dependencies():
         'stripe',
         'bcrypt',
         'openai',
-        'PyPDF2',
+        'pypdf',
         'reportlab',
         'pymupdf',
         'numpy',
+        'orjson',
         'pillow'
     ]
     
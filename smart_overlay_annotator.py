@@ -12,6 +12,18 @@ import numpy as np
 from multimodal_ai_client import MultimodalLlamaClient
 
 
+# Markdown characters stripped from annotation bullet points; bullet markers are
+# only trimmed from the ends so hyphenated words like "hands-on" survive
+_BULLET_STRIP = str.maketrans('', '', '*#')
+_BULLET_EDGES = ' \t-•'
+
+
+def _block_bboxes(text_blocks: Dict) -> np.ndarray:
+    """Collect text block bounding boxes as an (N, 4) array of (x0, y0, x1, y1)."""
+    bboxes = [block["bbox"] for block in text_blocks.get("blocks", []) if "bbox" in block]
+    return np.asarray(bboxes, dtype=np.float64).reshape(-1, 4)
+
+
 @dataclass
 class ContentHighlight:
     """Represents highlighted content that relates to an annotation."""
@@ -137,13 +149,14 @@ class SmartOverlayAnnotator:
             # Get text blocks and their positions
             text_blocks = page.get_text("dict")
             
-            # Analyze layout
+            # Analyze layout (margins are shared with white space detection)
+            margins = self._calculate_margins(page_rect, text_blocks)
             layout_info = {
                 "page_num": page_num,
                 "page_rect": page_rect,
                 "content_areas": self._identify_content_areas(text_blocks),
-                "margins": self._calculate_margins(page_rect, text_blocks),
-                "white_spaces": self._find_white_spaces(page_rect, text_blocks),
+                "margins": margins,
+                "white_spaces": self._find_white_spaces(page_rect, text_blocks, margins),
                 "section_boundaries": self._identify_sections(text_blocks),
                 "text_density": self._calculate_text_density(text_blocks, page_rect)
             }
@@ -184,13 +197,12 @@ class SmartOverlayAnnotator:
             min_y = page_rect.height
             max_y = 0
             
-            for block in text_blocks["blocks"]:
-                if "bbox" in block:
-                    bbox = block["bbox"]
-                    min_x = min(min_x, bbox[0])
-                    max_x = max(max_x, bbox[2])
-                    min_y = min(min_y, bbox[1])
-                    max_y = max(max_y, bbox[3])
+            bboxes = _block_bboxes(text_blocks)
+            if len(bboxes):
+                min_x = min(min_x, float(bboxes[:, 0].min()))
+                max_x = max(max_x, float(bboxes[:, 2].max()))
+                min_y = min(min_y, float(bboxes[:, 1].min()))
+                max_y = max(max_y, float(bboxes[:, 3].max()))
             
             # Calculate actual margins
             margins["left"] = max(20, min_x - 10)
@@ -200,12 +212,13 @@ class SmartOverlayAnnotator:
         
         return margins
     
-    def _find_white_spaces(self, page_rect: fitz.Rect, text_blocks: Dict) -> List[Dict]:
+    def _find_white_spaces(self, page_rect: fitz.Rect, text_blocks: Dict, margins: Dict = None) -> List[Dict]:
         """Find available white space areas for annotations."""
         white_spaces = []
         
         # Check right margin
-        margins = self._calculate_margins(page_rect, text_blocks)
+        if margins is None:
+            margins = self._calculate_margins(page_rect, text_blocks)
         
         # More flexible right margin check
         if margins["right"] > 60:  # Reduced requirement
@@ -305,11 +318,8 @@ class SmartOverlayAnnotator:
         if "blocks" not in text_blocks:
             return 0.0
         
-        total_text_area = 0
-        for block in text_blocks["blocks"]:
-            if "bbox" in block:
-                bbox = block["bbox"]
-                total_text_area += (bbox[2] - bbox[0]) * (bbox[3] - bbox[1])
+        bboxes = _block_bboxes(text_blocks)
+        total_text_area = float(((bboxes[:, 2] - bboxes[:, 0]) * (bboxes[:, 3] - bboxes[:, 1])).sum())
         
         page_area = page_rect.width * page_rect.height
         return total_text_area / page_area if page_area > 0 else 0.0
@@ -354,8 +364,6 @@ class SmartOverlayAnnotator:
         }
         
         # Map custom categories to priorities (first 2 = high, next 3 = medium, rest = low)
-        category_keys = list(custom_definitions.keys())
-        
         for i, (category_key, definition) in enumerate(custom_definitions.items()):
             # Extract annotations based on the user-defined meaning
             # Match the actual AI output format: ### 1. **Definition** (Spanish translation)
@@ -386,17 +394,20 @@ class SmartOverlayAnnotator:
         if isinstance(section_names, str):
             section_names = [section_names]
             
+        # Lowercase section names once and each line once, not per comparison
+        section_names = [section_name.lower() for section_name in section_names]
         lines = text.split('\n')
         in_section = False
         points = []
         
         for line in lines:
             line = line.strip()
+            line_lower = line.lower()
             
             # Check if we're entering any of the target sections
             section_found = False
             for section_name in section_names:
-                if section_name.lower() in line.lower() and ('**' in line or '##' in line or '*' in line):
+                if section_name in line_lower and ('**' in line or '##' in line or '*' in line):
                     in_section = True
                     section_found = True
                     break
@@ -406,7 +417,7 @@ class SmartOverlayAnnotator:
                 
             # Check if we're entering a new section (exit current)
             # Only exit if it's a proper section header (starts with ### or is numbered like "2. **")
-            elif in_section and (line.startswith('###') or (line.startswith(('1.', '2.', '3.', '4.', '5.', '6.', '7.', '8.')) and '**' in line)) and not any(sn.lower() in line.lower() for sn in section_names):
+            elif in_section and (line.startswith('###') or (line.startswith(('1.', '2.', '3.', '4.', '5.', '6.', '7.', '8.')) and '**' in line)) and not any(sn in line_lower for sn in section_names):
                 break
             # Extract bullet points and detailed content
             elif in_section and line:
@@ -416,7 +427,7 @@ class SmartOverlayAnnotator:
                 
                 # Extract bullet points (starting with -, *, or •)
                 if line.startswith(('-', '*', '•')):
-                    clean_line = line.replace('*', '').replace('#', '').replace('-', '').replace('•', '').strip()
+                    clean_line = line.translate(_BULLET_STRIP).strip(_BULLET_EDGES)
                     
                     # Extract just the main concept before colon
                     if ':' in clean_line:
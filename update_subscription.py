@@ -49,7 +49,7 @@ def list_all_users():
             print(f"Status: {user.subscription_status}")
             print(f"Premium: {user.is_premium()}")
             print(f"Profile limit: {user.get_profile_limit()}")
-            print(f"Profiles: {len(user.annotation_profiles)}")
+            print(f"Profiles: {user.get_profile_count()}")
             print("-" * 30)
 
 if __name__ == '__main__':